@@ -0,0 +1,147 @@
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from config import ARCHIVE_AFTER_DAYS, ARCHIVE_DIR
+from database import connection
+from money import MONEY_SCALE, AMOUNT_SCALE, units_sql
+
+# Old transactions move to one SQLite file per month, ARCHIVE_DIR/transactions_YYYY_MM.db
+ARCHIVE_BATCH = 10000
+VACUUM_PAGES = 5000
+# Kept in each file's PRAGMA user_version; 1 = amount and price in integer minor units
+ARCHIVE_VERSION = 1
+
+ARCHIVE_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS archive.transactions (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER,
+        ticker TEXT,
+        type TEXT,
+        amount INTEGER,
+        price INTEGER,
+        timestamp DATETIME
+    )
+'''
+ARCHIVE_INDEX = 'CREATE INDEX IF NOT EXISTS archive.idx_transactions_ticker_timestamp ON transactions (ticker, timestamp)'
+
+
+def archive_path(month):
+    return os.path.join(ARCHIVE_DIR, f'transactions_{month}.db')
+
+
+async def _attach(db, month):
+    """Attach a month's file as ``archive``, creating it or bringing an older
+    file up to ARCHIVE_VERSION first."""
+    await db.execute('ATTACH DATABASE ? AS archive', (archive_path(month),))
+    cursor = await db.execute('PRAGMA archive.user_version')
+    if (await cursor.fetchone())[0] >= ARCHIVE_VERSION:
+        return
+    try:
+        await db.execute('BEGIN IMMEDIATE')
+        cursor = await db.execute("SELECT 1 FROM archive.sqlite_master WHERE type = 'table' AND name = 'transactions'")
+        if await cursor.fetchone():
+            # Written before money moved to integer units: rebuild with converted values
+            await db.execute('ALTER TABLE archive.transactions RENAME TO transactions_real')
+            await db.execute(ARCHIVE_SCHEMA)
+            await db.execute(f'''
+                INSERT INTO archive.transactions
+                SELECT id, user_id, ticker, type, {units_sql('amount', AMOUNT_SCALE)}, {units_sql('price', MONEY_SCALE)}, timestamp
+                FROM archive.transactions_real
+            ''')
+            await db.execute('DROP TABLE archive.transactions_real')
+        else:
+            await db.execute(ARCHIVE_SCHEMA)
+        await db.execute(ARCHIVE_INDEX)
+        await db.execute(f'PRAGMA archive.user_version = {ARCHIVE_VERSION}')
+        await db.commit()
+    except BaseException:
+        if db.in_transaction:
+            await db.rollback()
+        await db.execute('DETACH DATABASE archive')
+        raise
+
+
+def _month_bounds(month):
+    start = datetime.strptime(month, '%Y_%m')
+    end = (start + timedelta(days=32)).replace(day=1)
+    return start.strftime('%Y-%m-%d %H:%M:%S'), end.strftime('%Y-%m-%d %H:%M:%S')
+
+
+async def archive_transactions():
+    """Move transactions older than ARCHIVE_AFTER_DAYS into per-month archive
+    files, in batches of ARCHIVE_BATCH rows, then release freed pages."""
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=ARCHIVE_AFTER_DAYS)).strftime('%Y-%m-%d %H:%M:%S')
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    moved = 0
+    async with connection() as db:
+        cursor = await db.execute('''
+            SELECT DISTINCT strftime('%Y_%m', timestamp) FROM transactions WHERE timestamp < ?
+        ''', (cutoff,))
+        months = [row[0] for row in await cursor.fetchall()]
+        for month in months:
+            start, end = _month_bounds(month)
+            end = min(end, cutoff)
+            await _attach(db, month)
+            try:
+                while True:
+                    await db.execute('BEGIN IMMEDIATE')
+                    batch = '''
+                        SELECT id FROM main.transactions
+                        WHERE timestamp >= ? AND timestamp < ? ORDER BY timestamp LIMIT ?
+                    '''
+                    # OR IGNORE keeps a rerun safe if a crash left a batch in both files
+                    cursor = await db.execute(f'INSERT OR IGNORE INTO archive.transactions SELECT * FROM main.transactions WHERE id IN ({batch})',
+                                              (start, end, ARCHIVE_BATCH))
+                    cursor = await db.execute(f'DELETE FROM main.transactions WHERE id IN ({batch})', (start, end, ARCHIVE_BATCH))
+                    count = cursor.rowcount
+                    await db.commit()
+                    moved += count
+                    if count < ARCHIVE_BATCH:
+                        break
+            finally:
+                if db.in_transaction:
+                    await db.rollback()
+                await db.execute('DETACH DATABASE archive')
+        if moved:
+            # Step the pragma to completion so the pages are actually released
+            cursor = await db.execute(f'PRAGMA incremental_vacuum({VACUUM_PAGES})')
+            await cursor.fetchall()
+    if moved:
+        logging.info("Archived %d transactions from %d month(s)", moved, len(months))
+    return moved
+
+
+def _archived_months():
+    if not os.path.isdir(ARCHIVE_DIR):
+        return []
+    months = [name[len('transactions_'):-len('.db')] for name in os.listdir(ARCHIVE_DIR)
+              if name.startswith('transactions_') and name.endswith('.db')]
+    return sorted(months, reverse=True)
+
+
+def has_archive():
+    """Whether any transactions have been moved to archive files yet."""
+    return bool(_archived_months())
+
+
+async def get_transaction_history(ticker, limit=100):
+    """Latest trades on ``ticker``, newest first, as (user_id, type, amount,
+    price, timestamp) rows. Archive files are attached only when the hot
+    table does not hold ``limit`` rows."""
+    query = '''
+        SELECT user_id, type, amount, price, timestamp FROM {table}
+        WHERE ticker = ? ORDER BY timestamp DESC LIMIT ?
+    '''
+    async with connection() as db:
+        cursor = await db.execute(query.format(table='main.transactions'), (ticker, limit))
+        rows = await cursor.fetchall()
+        for month in _archived_months():
+            if len(rows) >= limit:
+                break
+            await _attach(db, month)
+            try:
+                cursor = await db.execute(query.format(table='archive.transactions'), (ticker, limit - len(rows)))
+                rows.extend(await cursor.fetchall())
+            finally:
+                await db.execute('DETACH DATABASE archive')
+    return rows
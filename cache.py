@@ -0,0 +1,68 @@
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class LRUCache:
+    """Bounded mapping that evicts the least recently used key and forgets
+    entries older than ``ttl`` seconds."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        entry = self._data.get(key, _MISSING)
+        if entry is _MISSING:
+            return default
+        value, stored_at = entry
+        if time.monotonic() - stored_at > self.ttl:
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        self._data[key] = (value, time.monotonic())
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        entry = self._data.pop(key, _MISSING)
+        return default if entry is _MISSING else entry[0]
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class VersionClock:
+    """Per-key change counters for conditional requests, bounded to ``maxsize``
+    keys. Versions come from one increasing clock, and a forgotten key reports
+    the highest version forgotten so far, so a key's version never goes back
+    to a value it had before a change."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._versions = OrderedDict()
+        self._clock = 0
+        self._floor = 0
+
+    def bump(self, key):
+        self._clock += 1
+        self._versions[key] = self._clock
+        self._versions.move_to_end(key)
+        if len(self._versions) > self.maxsize:
+            _, version = self._versions.popitem(last=False)
+            self._floor = max(self._floor, version)
+
+    def get(self, key):
+        return self._versions.get(key, self._floor)
+
+    def __len__(self):
+        return len(self._versions)
@@ -0,0 +1,50 @@
+import asyncio
+import sys
+
+# Candle widths in seconds; a candle's bucket is its start time (unix seconds)
+INTERVALS = {
+    '1m': 60,
+    '1h': 3600,
+    '1d': 86400,
+}
+
+
+def candle_rows(ticker, fills):
+    """Roll (timestamp, price, amount) fills, in trade order, into one
+    (ticker, interval, bucket, open, high, low, close, volume, trades) row per
+    touched candle, ready to be upserted with UPSERT_CANDLE_SQL."""
+    candles = {}
+    for timestamp, price, amount in fills:
+        for interval, width in INTERVALS.items():
+            key = (interval, timestamp - timestamp % width)
+            candle = candles.get(key)
+            if candle is None:
+                candles[key] = [price, price, price, price, amount, 1]
+            else:
+                if price > candle[1]:
+                    candle[1] = price
+                if price < candle[2]:
+                    candle[2] = price
+                candle[3] = price
+                candle[4] += amount
+                candle[5] += 1
+    return [(ticker, interval, bucket, *candle) for (interval, bucket), candle in candles.items()]
+
+
+if __name__ == '__main__':
+    # python candles.py --backfill: rebuild candles from the transactions table
+    # (from its first whole day on once older transactions have been archived)
+    if '--backfill' not in sys.argv:
+        sys.exit("Usage: python candles.py --backfill")
+    from database import init_db, close_db, backfill_candles
+    from archive import has_archive
+
+    async def run_backfill():
+        await init_db()
+        try:
+            count = await backfill_candles(archived=has_archive())
+            print(f"Rebuilt candles from {count} transactions")
+        finally:
+            await close_db()
+
+    asyncio.run(run_backfill())
@@ -4,4 +4,38 @@ from dotenv import load_dotenv
 load_dotenv()
 
 BOT_TOKEN = os.getenv('BOT_TOKEN')
-ADMIN_ID = int(os.getenv('ADMIN_ID', 0))
\ No newline at end of file
+ADMIN_ID = int(os.getenv('ADMIN_ID', 0))
+
+# Transactions older than this are moved to per-month files in ARCHIVE_DIR
+ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', 90))
+ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', 'archive')
+
+# Mini-app HTTP API, served from the bot process
+API_HOST = os.getenv('API_HOST', '0.0.0.0')
+API_PORT = int(os.getenv('API_PORT', 8001))
+
+# Per-user token buckets: command class -> (tokens refilled per second, burst size)
+RATE_LIMITS = {
+    'casino': (0.5, 5),  # /dice, /dice_bot, /rob
+    'trade': (1, 10),  # /buy, /sell, /create_coin
+    'command': (2, 10),  # any other command or button
+    'api': (5, 20),  # /api/action, one token per action
+}
+RATE_LIMIT_MAX_KEYS = int(os.getenv('RATE_LIMIT_MAX_KEYS', 100000))
+# Most actions one POST /api/action/batch may carry
+MAX_BATCH_ACTIONS = 20
+
+# Opt-in SQL profiling (query_profiler.py): statements and rows per update or
+# API request, a slow query log with EXPLAIN QUERY PLAN and a periodic top-N report
+QUERY_PROFILING = os.getenv('QUERY_PROFILING', '0') == '1'
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', 50))
+QUERY_STATS_TOP_N = int(os.getenv('QUERY_STATS_TOP_N', 20))
+QUERY_STATS_INTERVAL = int(os.getenv('QUERY_STATS_INTERVAL', 15))  # minutes
+
+# Opt-in sampling profiler (sampling_profiler.py): updates slower than
+# PROFILE_BUDGET_MS are written as collapsed stacks to PROFILE_DIR, keeping the newest PROFILE_MAX_FILES
+SAMPLING_PROFILER = os.getenv('SAMPLING_PROFILER', '0') == '1'
+PROFILE_BUDGET_MS = float(os.getenv('PROFILE_BUDGET_MS', 1000))
+PROFILE_INTERVAL_MS = float(os.getenv('PROFILE_INTERVAL_MS', 5))
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+PROFILE_MAX_FILES = int(os.getenv('PROFILE_MAX_FILES', 100))
\ No newline at end of file
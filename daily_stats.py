@@ -0,0 +1,56 @@
+import asyncio
+import sys
+import time
+
+# Per-ticker stats for each UTC day (daily_stats), kept up to date inside every
+# trade's transaction, so reports read one row per ticker instead of scanning
+# transactions. Unique traders are counted through daily_traders, which only
+# has to remember the days still being traded; older rows are pruned.
+TRADERS_KEEP_DAYS = 2
+
+
+def day_of(timestamp):
+    """The UTC day of a unix timestamp, as YYYY-MM-DD."""
+    return time.strftime('%Y-%m-%d', time.gmtime(timestamp))
+
+
+def daily_groups(fills):
+    """Roll (timestamp, price, total, royalty, user_id) fills of one ticker, in
+    trade order, into {day: [volume, trades, open, close, royalties, user_ids]}."""
+    days = {}
+    for timestamp, price, total, royalty, user_id in fills:
+        day = day_of(timestamp)
+        group = days.get(day)
+        if group is None:
+            days[day] = [total, 1, price, price, royalty, {user_id}]
+        else:
+            group[0] += total
+            group[1] += 1
+            group[3] = price
+            group[4] += royalty
+            group[5].add(user_id)
+    return days
+
+
+def price_change(open_price, close_price):
+    """Change from the day's first fill price to its last, in percent."""
+    return (close_price - open_price) * 100 / open_price if open_price else 0.0
+
+
+if __name__ == '__main__':
+    # python daily_stats.py --backfill: rebuild daily stats from the transactions table
+    # (from its first whole day on once older transactions have been archived)
+    if '--backfill' not in sys.argv:
+        sys.exit("Usage: python daily_stats.py --backfill")
+    from database import init_db, close_db, backfill_daily_stats
+    from archive import has_archive
+
+    async def run_backfill():
+        await init_db()
+        try:
+            count = await backfill_daily_stats(archived=has_archive())
+            print(f"Rebuilt daily stats from {count} transactions")
+        finally:
+            await close_db()
+
+    asyncio.run(run_backfill())
@@ -1,12 +1,80 @@
 import aiosqlite
 import asyncio
-from datetime import datetime
-from decimal import Decimal
+import time
+from contextlib import asynccontextmanager
+from cache import LRUCache, VersionClock
+from money import MONEY_SCALE, AMOUNT_SCALE, RATE_SCALE, units_sql
+from pricing import CURVE_SCALE, spot_price, order_total, fill_price, set_curve, load_curves
+from candles import candle_rows
+from daily_stats import TRADERS_KEEP_DAYS, day_of, daily_groups
+from config import QUERY_PROFILING
+from query_profiler import ProfiledConnection
 
 DATABASE_PATH = 'casino_bot.db'
 
+# Connection pool
+POOL_SIZE = 4
+STATEMENT_CACHE_SIZE = 256
+PRAGMAS = (
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA busy_timeout = 5000',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA cache_size = -16000',
+    'PRAGMA mmap_size = 134217728',
+)
+
+_pool = None
+_pool_lock = asyncio.Lock()
+
+async def _open_connection():
+    db = await aiosqlite.connect(DATABASE_PATH, cached_statements=STATEMENT_CACHE_SIZE)
+    for pragma in PRAGMAS:
+        await db.execute(pragma)
+    if QUERY_PROFILING:
+        db = ProfiledConnection(db)
+    return db
+
+async def open_pool():
+    global _pool
+    async with _pool_lock:
+        if _pool is not None:
+            return
+        pool = asyncio.Queue()
+        for _ in range(POOL_SIZE):
+            pool.put_nowait(await _open_connection())
+        _pool = pool
+
+async def close_db():
+    global _pool
+    async with _pool_lock:
+        if _pool is None:
+            return
+        pool, _pool = _pool, None
+        for _ in range(POOL_SIZE):
+            db = await pool.get()
+            await db.close()
+
+@asynccontextmanager
+async def connection():
+    """Borrow a pooled connection; an unfinished transaction is rolled back on return."""
+    if _pool is None:
+        await open_pool()
+    pool = _pool
+    db = await pool.get()
+    try:
+        yield db
+    finally:
+        if db.in_transaction:
+            await db.rollback()
+        pool.put_nowait(db)
+
 async def init_db():
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+    # Schema work runs on its own connection before the pool opens, so pooled
+    # connections never prepare statements against a stale schema
+    db = await _open_connection()
+    try:
+        # Baseline schema; later changes (such as the integer money columns) come from MIGRATIONS
         # Users table
         await db.execute('''
             CREATE TABLE IF NOT EXISTS users (
@@ -76,196 +144,947 @@ async def init_db():
                 value TEXT
             )
         ''')
-        # Initialize bot balance if not exists
-        await db.execute('INSERT OR IGNORE INTO global_vars (key, value) VALUES (?, ?)', ('bot_balance', '10000'))
         await db.commit()
+        await run_migrations(db)
+    finally:
+        await db.close()
+    await open_pool()
+    await refresh_curves()
+
+def _copy_sequence(table, new_table):
+    """Statements carrying an AUTOINCREMENT counter over to a rebuilt table."""
+    return [
+        f"DELETE FROM sqlite_sequence WHERE name = '{new_table}'",
+        f"INSERT INTO sqlite_sequence (name, seq) SELECT '{new_table}', seq FROM sqlite_sequence WHERE name = '{table}'",
+    ]
+
+# Schema migrations, applied in order; PRAGMA user_version holds the last applied number.
+# An optional third element False runs the statements outside a transaction (for VACUUM).
+MIGRATIONS = [
+    (1, [
+        # Merge duplicate holdings so every (user_id, ticker) has exactly one row
+        '''UPDATE user_inventory SET amount = (
+               SELECT SUM(d.amount) FROM user_inventory d
+               WHERE d.user_id = user_inventory.user_id AND d.ticker = user_inventory.ticker)
+           WHERE id IN (SELECT MIN(id) FROM user_inventory GROUP BY user_id, ticker)''',
+        'DELETE FROM user_inventory WHERE id NOT IN (SELECT MIN(id) FROM user_inventory GROUP BY user_id, ticker)',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_user_inventory_user_ticker ON user_inventory (user_id, ticker)',
+    ]),
+    (2, [
+        'CREATE INDEX IF NOT EXISTS idx_users_username ON users (username)',
+    ]),
+    (3, [
+        'CREATE INDEX IF NOT EXISTS idx_inventory_type_expires ON inventory (item_type, expires_at)',
+    ]),
+    (4, [
+        'CREATE INDEX IF NOT EXISTS idx_transactions_ticker_timestamp ON transactions (ticker, timestamp)',
+    ]),
+    (5, [
+        # The bot treasury moves from a TEXT global var to a numeric single-row ledger
+        'CREATE TABLE IF NOT EXISTS treasury (id INTEGER PRIMARY KEY CHECK (id = 1), balance REAL NOT NULL)',
+        "INSERT OR IGNORE INTO treasury (id, balance) SELECT 1, CAST(value AS REAL) FROM global_vars WHERE key = 'bot_balance'",
+        'INSERT OR IGNORE INTO treasury (id, balance) VALUES (1, 10000)',
+        "DELETE FROM global_vars WHERE key = 'bot_balance'",
+    ]),
+    (6, [
+        # OHLCV rollups per ticker; bucket is the candle start in unix seconds
+        '''CREATE TABLE IF NOT EXISTS candles (
+               ticker TEXT NOT NULL,
+               interval TEXT NOT NULL,
+               bucket INTEGER NOT NULL,
+               open REAL NOT NULL,
+               high REAL NOT NULL,
+               low REAL NOT NULL,
+               close REAL NOT NULL,
+               volume REAL NOT NULL,
+               trades INTEGER NOT NULL,
+               PRIMARY KEY (ticker, interval, bucket)
+           ) WITHOUT ROWID''',
+    ]),
+    (7, [
+        'CREATE INDEX IF NOT EXISTS idx_transactions_timestamp ON transactions (timestamp)',
+    ]),
+    (8, [
+        # Lets the archive job hand freed pages back with PRAGMA incremental_vacuum;
+        # the one-time VACUUM rewrites the file so the setting takes effect
+        'PRAGMA auto_vacuum = INCREMENTAL',
+        'VACUUM',
+    ], False),
+    (9, [
+        # Money, token amounts and fee rates move from REAL to integer minor units.
+        # SQLite can't change a column's type in place, so each table is rebuilt.
+        f'''CREATE TABLE users_new (
+               id INTEGER PRIMARY KEY,
+               username TEXT,
+               balance INTEGER DEFAULT {1000 * MONEY_SCALE},
+               vip_status INTEGER DEFAULT 0,
+               title TEXT DEFAULT '',
+               total_royalties INTEGER DEFAULT 0
+           )''',
+        f'''INSERT INTO users_new SELECT id, username, {units_sql('balance', MONEY_SCALE)}, vip_status, title,
+               {units_sql('total_royalties', MONEY_SCALE)} FROM users''',
+        'DROP TABLE users',
+        'ALTER TABLE users_new RENAME TO users',
+        'CREATE INDEX idx_users_username ON users (username)',
+        '''CREATE TABLE coins_new (
+               ticker TEXT PRIMARY KEY,
+               creator_id INTEGER,
+               initial_price INTEGER,
+               current_supply INTEGER DEFAULT 0,
+               total_volume INTEGER DEFAULT 0,
+               tier TEXT,
+               royalty_fee INTEGER,
+               bot_fee INTEGER,
+               created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+               FOREIGN KEY (creator_id) REFERENCES users (id)
+           )''',
+        f'''INSERT INTO coins_new SELECT ticker, creator_id, {units_sql('initial_price', MONEY_SCALE)},
+               {units_sql('current_supply', AMOUNT_SCALE)}, {units_sql('total_volume', MONEY_SCALE)}, tier,
+               {units_sql('royalty_fee', RATE_SCALE)}, {units_sql('bot_fee', RATE_SCALE)}, created_at FROM coins''',
+        'DROP TABLE coins',
+        'ALTER TABLE coins_new RENAME TO coins',
+        '''CREATE TABLE user_inventory_new (
+               id INTEGER PRIMARY KEY AUTOINCREMENT,
+               user_id INTEGER,
+               ticker TEXT,
+               amount INTEGER,
+               FOREIGN KEY (user_id) REFERENCES users (id),
+               FOREIGN KEY (ticker) REFERENCES coins (ticker)
+           )''',
+        f"INSERT INTO user_inventory_new SELECT id, user_id, ticker, {units_sql('amount', AMOUNT_SCALE)} FROM user_inventory",
+        *_copy_sequence('user_inventory', 'user_inventory_new'),
+        'DROP TABLE user_inventory',
+        'ALTER TABLE user_inventory_new RENAME TO user_inventory',
+        'CREATE UNIQUE INDEX idx_user_inventory_user_ticker ON user_inventory (user_id, ticker)',
+        '''CREATE TABLE transactions_new (
+               id INTEGER PRIMARY KEY AUTOINCREMENT,
+               user_id INTEGER,
+               ticker TEXT,
+               type TEXT,  -- buy/sell
+               amount INTEGER,
+               price INTEGER,
+               timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+               FOREIGN KEY (user_id) REFERENCES users (id),
+               FOREIGN KEY (ticker) REFERENCES coins (ticker)
+           )''',
+        f'''INSERT INTO transactions_new SELECT id, user_id, ticker, type, {units_sql('amount', AMOUNT_SCALE)},
+               {units_sql('price', MONEY_SCALE)}, timestamp FROM transactions''',
+        # Archived ids must never be handed out again
+        *_copy_sequence('transactions', 'transactions_new'),
+        'DROP TABLE transactions',
+        'ALTER TABLE transactions_new RENAME TO transactions',
+        'CREATE INDEX idx_transactions_ticker_timestamp ON transactions (ticker, timestamp)',
+        'CREATE INDEX idx_transactions_timestamp ON transactions (timestamp)',
+        'CREATE TABLE treasury_new (id INTEGER PRIMARY KEY CHECK (id = 1), balance INTEGER NOT NULL)',
+        f"INSERT INTO treasury_new SELECT id, {units_sql('balance', MONEY_SCALE)} FROM treasury",
+        'DROP TABLE treasury',
+        'ALTER TABLE treasury_new RENAME TO treasury',
+        '''CREATE TABLE candles_new (
+               ticker TEXT NOT NULL,
+               interval TEXT NOT NULL,
+               bucket INTEGER NOT NULL,
+               open INTEGER NOT NULL,
+               high INTEGER NOT NULL,
+               low INTEGER NOT NULL,
+               close INTEGER NOT NULL,
+               volume INTEGER NOT NULL,
+               trades INTEGER NOT NULL,
+               PRIMARY KEY (ticker, interval, bucket)
+           ) WITHOUT ROWID''',
+        f'''INSERT INTO candles_new SELECT ticker, interval, bucket, {units_sql('open', MONEY_SCALE)},
+               {units_sql('high', MONEY_SCALE)}, {units_sql('low', MONEY_SCALE)}, {units_sql('close', MONEY_SCALE)},
+               {units_sql('volume', AMOUNT_SCALE)}, trades FROM candles''',
+        'DROP TABLE candles',
+        'ALTER TABLE candles_new RENAME TO candles',
+    ]),
+    (10, [
+        # Open /dice challenges, keyed by the bot message carrying the accept button
+        '''CREATE TABLE IF NOT EXISTS duels (
+               chat_id INTEGER NOT NULL,
+               message_id INTEGER NOT NULL,
+               challenger_id INTEGER NOT NULL,
+               challenger_username TEXT,
+               target_username TEXT NOT NULL,
+               amount INTEGER NOT NULL,
+               expires_at INTEGER NOT NULL,
+               PRIMARY KEY (chat_id, message_id)
+           ) WITHOUT ROWID''',
+    ]),
+    (11, [
+        # Inventory expiries move from local-time text to unix seconds, which sort and
+        # compare as numbers; expired rows are deleted by expiry.sweep() from now on
+        '''CREATE TABLE inventory_new (
+               id INTEGER PRIMARY KEY AUTOINCREMENT,
+               user_id INTEGER,
+               item_type TEXT,
+               item_name TEXT,
+               expires_at INTEGER,
+               FOREIGN KEY (user_id) REFERENCES users (id)
+           )''',
+        """INSERT INTO inventory_new SELECT id, user_id, item_type, item_name,
+               CAST(strftime('%s', expires_at, 'utc') AS INTEGER) FROM inventory""",
+        *_copy_sequence('inventory', 'inventory_new'),
+        'DROP TABLE inventory',
+        'ALTER TABLE inventory_new RENAME TO inventory',
+        'CREATE INDEX idx_inventory_user_type ON inventory (user_id, item_type)',
+        'CREATE INDEX idx_inventory_type_expires ON inventory (item_type, expires_at)',
+        'CREATE INDEX idx_inventory_expires ON inventory (expires_at) WHERE expires_at IS NOT NULL',
+        'CREATE INDEX IF NOT EXISTS idx_duels_expires ON duels (expires_at)',
+    ]),
+    (12, [
+        # Per-ticker stats for each UTC day, written with every trade (see daily_stats.py)
+        '''CREATE TABLE IF NOT EXISTS daily_stats (
+               day TEXT NOT NULL,
+               ticker TEXT NOT NULL,
+               volume INTEGER NOT NULL,
+               trades INTEGER NOT NULL,
+               traders INTEGER NOT NULL,
+               open_price INTEGER NOT NULL,
+               close_price INTEGER NOT NULL,
+               royalties INTEGER NOT NULL,
+               PRIMARY KEY (day, ticker)
+           ) WITHOUT ROWID''',
+        '''CREATE TABLE IF NOT EXISTS daily_traders (
+               day TEXT NOT NULL,
+               ticker TEXT NOT NULL,
+               user_id INTEGER NOT NULL,
+               PRIMARY KEY (day, ticker, user_id)
+           ) WITHOUT ROWID''',
+    ]),
+]
+
+async def get_schema_version(db):
+    cursor = await db.execute('PRAGMA user_version')
+    return (await cursor.fetchone())[0]
+
+async def run_migrations(db):
+    version = await get_schema_version(db)
+    for number, statements, *options in MIGRATIONS:
+        if number <= version:
+            continue
+        in_transaction = options[0] if options else True
+        if in_transaction:
+            await db.execute('BEGIN IMMEDIATE')
+        for sql in statements:
+            await db.execute(sql)
+        await db.execute(f'PRAGMA user_version = {number}')
+        await db.commit()
+        print(f"Applied migration {number}")
 
 async def get_user(user_id):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+    async with connection() as db:
         cursor = await db.execute('SELECT * FROM users WHERE id = ?', (user_id,))
         return await cursor.fetchone()
 
+# Profiles (id, username, vip_status, title) rarely change, so they are cached
+# in memory and kept current by the helpers that write them
+USER_CACHE_SIZE = 10000
+USER_CACHE_TTL = 600
+
+_user_cache = LRUCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+
+async def get_user_profile(user_id):
+    profile = _user_cache.get(user_id)
+    if profile is None:
+        async with connection() as db:
+            cursor = await db.execute('SELECT id, username, vip_status, title FROM users WHERE id = ?', (user_id,))
+            profile = await cursor.fetchone()
+        if profile:
+            _user_cache.set(user_id, profile)
+    return profile
+
+def _update_profile(user_id, **fields):
+    profile = _user_cache.get(user_id)
+    if profile is None:
+        return
+    user_id, username, vip_status, title = profile
+    _user_cache.set(user_id, (
+        user_id,
+        fields.get('username', username),
+        fields.get('vip_status', vip_status),
+        fields.get('title', title),
+    ))
+
+# Every write to a balance or holding bumps the user's version, after the
+# commit, so /api/user can answer If-None-Match without reading SQLite
+USER_VERSION_SLOTS = 100000
+
+_user_versions = VersionClock(USER_VERSION_SLOTS)
+_user_listeners = []
+
+def get_user_version(user_id):
+    return _user_versions.get(user_id)
+
+def add_user_listener(callback):
+    """Have ``callback(user_id)`` called (synchronously) after every committed
+    write to a user's balance or holdings."""
+    _user_listeners.append(callback)
+
+def _bump(*user_ids):
+    for user_id in user_ids:
+        _user_versions.bump(user_id)
+        for listener in _user_listeners:
+            listener(user_id)
+
+async def get_user_snapshot(user_id):
+    """Balance and holdings in one query, as (balance, [{'name', 'amount'}]);
+    None for an unknown user."""
+    async with connection() as db:
+        cursor = await db.execute('''
+            SELECT u.balance, ui.ticker, ui.amount FROM users u
+            LEFT JOIN user_inventory ui ON ui.user_id = u.id
+            WHERE u.id = ?
+        ''', (user_id,))
+        rows = await cursor.fetchall()
+    if not rows:
+        return None
+    return rows[0][0], [{'name': ticker, 'amount': amount} for _, ticker, amount in rows if ticker is not None]
+
 async def create_user(user_id, username):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        await db.execute('INSERT INTO users (id, username) VALUES (?, ?)', (user_id, username))
+    async with connection() as db:
+        cursor = await db.execute('INSERT OR IGNORE INTO users (id, username) VALUES (?, ?)', (user_id, username))
         await db.commit()
+    if cursor.rowcount:
+        _user_cache.set(user_id, (user_id, username, 0, ''))
+        _bump(user_id)
 
 async def update_balance(user_id, amount):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+    async with connection() as db:
         await db.execute('UPDATE users SET balance = balance + ? WHERE id = ?', (amount, user_id))
         await db.commit()
+    _bump(user_id)
 
 async def set_balance(user_id, amount):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+    async with connection() as db:
         await db.execute('UPDATE users SET balance = ? WHERE id = ?', (amount, user_id))
         await db.commit()
+    _bump(user_id)
 
 async def get_balance(user_id):
     user = await get_user(user_id)
     return user[2] if user else 0
 
 async def set_vip(user_id, status):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+    async with connection() as db:
         await db.execute('UPDATE users SET vip_status = ? WHERE id = ?', (status, user_id))
         await db.commit()
+    _update_profile(user_id, vip_status=status)
 
 async def set_title(user_id, title):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+    async with connection() as db:
         await db.execute('UPDATE users SET title = ? WHERE id = ?', (title, user_id))
         await db.commit()
+    _update_profile(user_id, title=title)
 
 async def get_global_var(key):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+    async with connection() as db:
         cursor = await db.execute('SELECT value FROM global_vars WHERE key = ?', (key,))
         row = await cursor.fetchone()
         return row[0] if row else None
 
 async def set_global_var(key, value):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+    async with connection() as db:
         await db.execute('INSERT OR REPLACE INTO global_vars (key, value) VALUES (?, ?)', (key, value))
         await db.commit()
 
 async def add_inventory(user_id, item_type, item_name, expires_at=None):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+    """``expires_at`` is in unix seconds; None never expires."""
+    async with connection() as db:
         await db.execute('INSERT INTO inventory (user_id, item_type, item_name, expires_at) VALUES (?, ?, ?, ?)',
                          (user_id, item_type, item_name, expires_at))
         await db.commit()
 
 async def get_inventory(user_id, item_type=None):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+    async with connection() as db:
         if item_type:
             cursor = await db.execute('SELECT * FROM inventory WHERE user_id = ? AND item_type = ? AND (expires_at IS NULL OR expires_at > ?)',
-                                      (user_id, item_type, datetime.now()))
+                                      (user_id, item_type, int(time.time())))
         else:
             cursor = await db.execute('SELECT * FROM inventory WHERE user_id = ? AND (expires_at IS NULL OR expires_at > ?)',
-                                      (user_id, datetime.now()))
+                                      (user_id, int(time.time())))
+        return await cursor.fetchall()
+
+async def get_active_triggers():
+    async with connection() as db:
+        cursor = await db.execute('SELECT user_id, item_name, expires_at FROM inventory WHERE item_type = ? AND (expires_at IS NULL OR expires_at > ?)',
+                                  ('Effects', int(time.time())))
         return await cursor.fetchall()
 
 async def get_title(user_id):
-    user = await get_user(user_id)
-    return user[4] if user else ''
+    profile = await get_user_profile(user_id)
+    return profile[3] if profile else ''
 
 async def get_address(user_id):
-    user = await get_user(user_id)
-    title = user[4] if user else ''
-    username = user[1] if user else 'User'
+    profile = await get_user_profile(user_id)
+    title = profile[3] if profile else ''
+    username = profile[1] if profile else 'User'
     return f"{title} {username}" if title else username
 
 async def get_user_by_username(username):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+    async with connection() as db:
         cursor = await db.execute('SELECT id FROM users WHERE username = ?', (username,))
         row = await cursor.fetchone()
         return row[0] if row else None
 
 async def update_royalties(user_id, amount):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+    async with connection() as db:
         await db.execute('UPDATE users SET total_royalties = total_royalties + ? WHERE id = ?', (amount, user_id))
         await db.commit()
 
+# Equity = cash balance + holdings valued at the bonding-curve spot price, in
+# integer money units with the same rounding as pricing.spot_price
+EQUITY_SQL = f'''
+    SELECT u.id, u.username, u.balance,
+           u.balance + COALESCE(SUM(
+               ui.amount * (c.initial_price * ({CURVE_SCALE} + c.current_supply) / {CURVE_SCALE}) / {AMOUNT_SCALE}
+           ), 0) AS equity
+    FROM users u
+    LEFT JOIN user_inventory ui ON ui.user_id = u.id
+    LEFT JOIN coins c ON c.ticker = ui.ticker
+'''
+
 async def get_total_equity(user_id):
-    balance = await get_balance(user_id)
-    # Calculate value of tokens
-    holdings = await get_user_tokens(user_id)
-    equity = Decimal(str(balance))
-    for ticker, amount in holdings:
-        price = await get_coin_price(ticker)
-        equity += Decimal(str(amount)) * price
-    return float(equity)
+    async with connection() as db:
+        cursor = await db.execute(EQUITY_SQL + ' WHERE u.id = ? GROUP BY u.id', (user_id,))
+        row = await cursor.fetchone()
+        return row[3] if row else 0
 
 # Coin functions
 async def create_coin(ticker, creator_id, initial_price, tier, royalty_fee, bot_fee):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+    async with connection() as db:
         await db.execute('INSERT INTO coins (ticker, creator_id, initial_price, tier, royalty_fee, bot_fee) VALUES (?, ?, ?, ?, ?, ?)',
                          (ticker, creator_id, initial_price, tier, royalty_fee, bot_fee))
         await db.commit()
+    set_curve(ticker, initial_price, 0)
 
 async def get_coin(ticker):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+    async with connection() as db:
         cursor = await db.execute('SELECT * FROM coins WHERE ticker = ?', (ticker,))
         return await cursor.fetchone()
 
 async def update_coin_supply(ticker, new_supply):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+    async with connection() as db:
         await db.execute('UPDATE coins SET current_supply = ? WHERE ticker = ?', (new_supply, ticker))
         await db.commit()
 
 async def update_coin_volume(ticker, volume):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+    async with connection() as db:
         await db.execute('UPDATE coins SET total_volume = total_volume + ? WHERE ticker = ?', (volume, ticker))
         await db.commit()
 
+async def refresh_curves():
+    """Load the pricing curve cache for every coin in one query (at startup;
+    after that the cache is kept current as coins are created and traded)."""
+    async with connection() as db:
+        cursor = await db.execute('SELECT ticker, initial_price, current_supply FROM coins')
+        load_curves(await cursor.fetchall())
+
 async def get_coin_price(ticker):
     coin = await get_coin(ticker)
     if not coin:
-        return Decimal('0')
-    supply = Decimal(str(coin[3]))  # current_supply
-    initial = Decimal(str(coin[2]))  # initial_price
-    # Simple bonding curve: price increases with supply
-    if supply == 0:
-        return initial
-    return initial * (supply / 1000 + 1)
+        return 0
+    return spot_price(coin[2], coin[3])  # initial_price, current_supply
 
 # User inventory
 async def add_to_inventory(user_id, ticker, amount):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        # Check if exists
-        cursor = await db.execute('SELECT amount FROM user_inventory WHERE user_id = ? AND ticker = ?', (user_id, ticker))
-        row = await cursor.fetchone()
-        if row:
-            new_amount = Decimal(str(row[0])) + Decimal(str(amount))
-            await db.execute('UPDATE user_inventory SET amount = ? WHERE user_id = ? AND ticker = ?', (float(new_amount), user_id, ticker))
-        else:
-            await db.execute('INSERT INTO user_inventory (user_id, ticker, amount) VALUES (?, ?, ?)', (user_id, ticker, amount))
+    async with connection() as db:
+        await db.execute('''
+            INSERT INTO user_inventory (user_id, ticker, amount) VALUES (?, ?, ?)
+            ON CONFLICT (user_id, ticker) DO UPDATE SET amount = amount + excluded.amount
+        ''', (user_id, ticker, amount))
         await db.commit()
+    _bump(user_id)
 
 async def remove_from_inventory(user_id, ticker, amount):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+    async with connection() as db:
         cursor = await db.execute('SELECT amount FROM user_inventory WHERE user_id = ? AND ticker = ?', (user_id, ticker))
         row = await cursor.fetchone()
         if row:
-            new_amount = Decimal(str(row[0])) - Decimal(str(amount))
+            new_amount = row[0] - amount
             if new_amount <= 0:
                 await db.execute('DELETE FROM user_inventory WHERE user_id = ? AND ticker = ?', (user_id, ticker))
             else:
-                await db.execute('UPDATE user_inventory SET amount = ? WHERE user_id = ? AND ticker = ?', (float(new_amount), user_id, ticker))
+                await db.execute('UPDATE user_inventory SET amount = ? WHERE user_id = ? AND ticker = ?', (new_amount, user_id, ticker))
         await db.commit()
+    _bump(user_id)
 
 async def get_user_tokens(user_id):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+    async with connection() as db:
         cursor = await db.execute('SELECT ticker, amount FROM user_inventory WHERE user_id = ?', (user_id,))
         return await cursor.fetchall()
 
+# Treasury ledger
+async def get_treasury_balance():
+    async with connection() as db:
+        cursor = await db.execute('SELECT balance FROM treasury WHERE id = 1')
+        row = await cursor.fetchone()
+        return row[0] if row else 0
+
+async def add_treasury_balance(delta):
+    """Apply a delta to the treasury and return the new balance."""
+    async with connection() as db:
+        cursor = await db.execute('UPDATE treasury SET balance = balance + ? WHERE id = 1 RETURNING balance', (delta,))
+        row = await cursor.fetchone()
+        await db.commit()
+        return row[0]
+
+async def set_treasury_balance(amount):
+    async with connection() as db:
+        await db.execute('UPDATE treasury SET balance = ? WHERE id = 1', (amount,))
+        await db.commit()
+
+# Trade engine
+class TradeError(Exception):
+    """A trade was rejected; ``reason`` is one of not_found, invalid_amount,
+    insufficient_balance or insufficient_tokens."""
+
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+@asynccontextmanager
+async def transaction():
+    """Run several writes as one BEGIN IMMEDIATE transaction: yields a
+    Transaction, commits when the block exits normally and rolls back if it
+    raises. Cache updates are held back until the commit."""
+    after_commit = []
+    async with connection() as db:
+        await db.execute('BEGIN IMMEDIATE')
+        yield Transaction(db, after_commit)
+        await db.commit()
+    for effect in after_commit:
+        effect()
+
+class Transaction:
+    """Writes that can share one open transaction (see transaction())."""
+
+    def __init__(self, db, after_commit):
+        self.db = db
+        self._after_commit = after_commit
+        self._savepoints = 0
+
+    @asynccontextmanager
+    async def savepoint(self):
+        """Undo only this block's writes if it raises; the exception propagates."""
+        self._savepoints += 1
+        name = f'sp{self._savepoints}'
+        mark = len(self._after_commit)
+        await self.db.execute(f'SAVEPOINT {name}')
+        try:
+            yield
+        except BaseException:
+            await self.db.execute(f'ROLLBACK TO {name}')
+            await self.db.execute(f'RELEASE {name}')
+            del self._after_commit[mark:]
+            raise
+        else:
+            await self.db.execute(f'RELEASE {name}')
+        finally:
+            self._savepoints -= 1
+
+    async def trades(self, ticker, orders):
+        """execute_trades within this transaction."""
+        return await _apply_trades(self.db, ticker, orders, self._after_commit)
+
+    async def trade(self, user_id, ticker, side, amount):
+        """A single order; raises TradeError if it is rejected."""
+        result = (await self.trades(ticker, [(user_id, side, amount)]))[0]
+        if isinstance(result, TradeError):
+            raise result
+        return result
+
+    async def add_balance(self, user_id, amount):
+        await self.db.execute('UPDATE users SET balance = balance + ? WHERE id = ?', (amount, user_id))
+        self._after_commit.append(lambda: _bump(user_id))
+
+    async def get_user_by_username(self, username):
+        cursor = await self.db.execute('SELECT id FROM users WHERE username = ?', (username,))
+        row = await cursor.fetchone()
+        return row[0] if row else None
+
+    async def charge(self, user_id, amount):
+        """Take ``amount`` from the user's balance; False (and no write) if it is short."""
+        cursor = await self.db.execute('UPDATE users SET balance = balance - ? WHERE id = ? AND balance >= ?',
+                                       (amount, user_id, amount))
+        if not cursor.rowcount:
+            return False
+        self._after_commit.append(lambda: _bump(user_id))
+        return True
+
+    async def create_coin(self, ticker, creator_id, initial_price, tier, royalty_fee, bot_fee):
+        """Raises sqlite3.IntegrityError if the ticker is taken."""
+        await self.db.execute('INSERT INTO coins (ticker, creator_id, initial_price, tier, royalty_fee, bot_fee) VALUES (?, ?, ?, ?, ?, ?)',
+                              (ticker, creator_id, initial_price, tier, royalty_fee, bot_fee))
+        self._after_commit.append(lambda: set_curve(ticker, initial_price, 0))
+
+async def execute_trade(user_id, ticker, side, amount):
+    """Apply a single buy or sell atomically; raises TradeError if it is rejected."""
+    result = (await execute_trades(ticker, [(user_id, side, amount)]))[0]
+    if isinstance(result, TradeError):
+        raise result
+    return result
+
+async def execute_trades(ticker, orders):
+    """Apply a sequence of (user_id, side, amount) orders on one ticker in a
+    single BEGIN IMMEDIATE transaction. Amounts, prices and balances are
+    integer minor units (see money.py).
+
+    Orders are priced one after another against the running supply, so each
+    sees the price left by the one before it. Supply, volume, balances,
+    holdings, the creator's royalties and the OHLCV candles are written once
+    per batch, coalesced per row. Bot fees and the audit rows are left to the caller
+    (order_queue.settle_fills). Returns one entry per order:
+    a result dict with the execution and post-trade prices and the new
+    balances, or the TradeError that rejected it.
+    """
+    async with transaction() as tx:
+        return await tx.trades(ticker, orders)
+
+async def _apply_trades(db, ticker, orders, after_commit):
+    # Body of execute_trades on a connection already inside a transaction;
+    # cache updates go to after_commit so they only happen if it commits
+    for _, side, _ in orders:
+        if side not in ('buy', 'sell'):
+            raise ValueError(f'Unknown trade side: {side}')
+    user_ids = list({user_id for user_id, _, _ in orders})
+    placeholders = ', '.join('?' * len(user_ids))
+
+    cursor = await db.execute('''
+        SELECT c.creator_id, c.initial_price, c.current_supply, c.royalty_fee, c.bot_fee, u.username
+        FROM coins c LEFT JOIN users u ON u.id = c.creator_id
+        WHERE c.ticker = ?
+    ''', (ticker,))
+    coin = await cursor.fetchone()
+    if not coin:
+        return [TradeError('not_found') for _ in orders]
+    creator_id, initial_price, supply, royalty_fee, bot_fee, creator_username = coin
+
+    cursor = await db.execute(f'SELECT id, balance FROM users WHERE id IN ({placeholders})', user_ids)
+    balances = dict(await cursor.fetchall())
+    cursor = await db.execute(f'SELECT user_id, amount FROM user_inventory WHERE ticker = ? AND user_id IN ({placeholders})',
+                              [ticker, *user_ids])
+    holdings = dict(await cursor.fetchall())
+
+    volume = royalties = 0
+    touched = set()
+    fills = []
+    daily_fills = []
+    results = []
+    now = int(time.time())
+    for user_id, side, amount in orders:
+        if amount <= 0:
+            results.append(TradeError('invalid_amount'))
+            continue
+        balance = balances.get(user_id)
+        holding = holdings.get(user_id, 0)
+        total = order_total(initial_price, supply, side, amount)
+        if side == 'buy':
+            if balance is None or balance < total:
+                results.append(TradeError('insufficient_balance'))
+                continue
+            supply += amount
+            balance -= total
+            holding += amount
+        else:
+            if balance is None or holding < amount:
+                results.append(TradeError('insufficient_tokens'))
+                continue
+            supply -= amount
+            balance += total
+            holding -= amount
+        balances[user_id] = balance
+        holdings[user_id] = holding
+        touched.add(user_id)
+
+        price = fill_price(total, amount)
+        royalty = total * royalty_fee // RATE_SCALE
+        fee = total * bot_fee // RATE_SCALE
+        volume += total
+        royalties += royalty
+        fills.append((now, price, amount))
+        daily_fills.append((now, price, total, royalty, user_id))
+        results.append({
+            'user_id': user_id,
+            'ticker': ticker,
+            'side': side,
+            'amount': amount,
+            'price': price,
+            'total': total,
+            'new_price': spot_price(initial_price, supply),
+            'balance': balance,
+            'holding': holding,
+            'royalty': royalty,
+            'bot_fee': fee,
+            'creator_id': creator_id,
+            'creator_username': creator_username,
+            'timestamp': now,
+        })
+
+    if not fills:
+        return results
+    await db.execute('UPDATE coins SET current_supply = ?, total_volume = total_volume + ? WHERE ticker = ?',
+                     (supply, volume, ticker))
+    await db.executemany('UPDATE users SET balance = ? WHERE id = ?',
+                         [(balances[user_id], user_id) for user_id in touched])
+    await db.executemany('''
+        INSERT INTO user_inventory (user_id, ticker, amount) VALUES (?, ?, ?)
+        ON CONFLICT (user_id, ticker) DO UPDATE SET amount = excluded.amount
+    ''', [(user_id, ticker, holdings[user_id]) for user_id in touched if holdings[user_id] > 0])
+    await db.executemany('DELETE FROM user_inventory WHERE user_id = ? AND ticker = ?',
+                         [(user_id, ticker) for user_id in touched if holdings[user_id] <= 0])
+    await db.execute('UPDATE users SET total_royalties = total_royalties + ? WHERE id = ?', (royalties, creator_id))
+    await db.executemany(UPSERT_CANDLE_SQL, candle_rows(ticker, fills))
+    await _add_daily_stats(db, ticker, daily_fills)
+    after_commit.append(lambda: set_curve(ticker, initial_price, supply))
+    after_commit.append(lambda: _bump(*touched))
+    return results
+
 # Transactions
-async def add_transaction(user_id, ticker, type_, amount, price):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        await db.execute('INSERT INTO transactions (user_id, ticker, type, amount, price) VALUES (?, ?, ?, ?, ?)',
-                         (user_id, ticker, type_, amount, price))
+async def add_transactions(rows):
+    """Insert (user_id, ticker, type, amount, price, timestamp) rows in one commit."""
+    async with connection() as db:
+        await db.executemany('INSERT INTO transactions (user_id, ticker, type, amount, price, timestamp) VALUES (?, ?, ?, ?, ?, ?)', rows)
         await db.commit()
 
+# Candles
+UPSERT_CANDLE_SQL = '''
+    INSERT INTO candles (ticker, interval, bucket, open, high, low, close, volume, trades)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (ticker, interval, bucket) DO UPDATE SET
+        high = max(high, excluded.high),
+        low = min(low, excluded.low),
+        close = excluded.close,
+        volume = volume + excluded.volume,
+        trades = trades + excluded.trades
+'''
+
+async def get_candles(ticker, interval, limit=200):
+    """The latest ``limit`` candles, oldest first, as (bucket, open, high, low, close, volume) rows."""
+    async with connection() as db:
+        cursor = await db.execute('''
+            SELECT bucket, open, high, low, close, volume FROM candles
+            WHERE ticker = ? AND interval = ?
+            ORDER BY bucket DESC LIMIT ?
+        ''', (ticker, interval, limit))
+        rows = await cursor.fetchall()
+    rows.reverse()
+    return rows
+
+BACKFILL_CHUNK = 5000
+
+async def _backfill_start(db, archived):
+    # Unix time a rebuild from transactions starts at: 0 (everything) unless older
+    # transactions were archived; the oldest day left is then split with the
+    # archive, so the rebuild starts at the UTC midnight after it. None when
+    # there is nothing to rebuild from.
+    if not archived:
+        return 0
+    cursor = await db.execute("SELECT CAST(strftime('%s', MIN(timestamp)) AS INTEGER) FROM transactions")
+    first = (await cursor.fetchone())[0]
+    return None if first is None else first - first % 86400 + 86400
+
+async def backfill_candles(archived=False):
+    """Rebuild candles in one streaming pass over transactions; returns the
+    number of transactions read. Pass ``archived`` once the archive job has
+    run: only candles from the first whole day left in the table are then
+    replaced, and older ones are kept. Holds the write lock throughout, so run
+    it while the bot is stopped."""
+    count = 0
+    async with connection() as db:
+        await db.execute('BEGIN IMMEDIATE')
+        start = await _backfill_start(db, archived)
+        if start is None:
+            await db.rollback()
+            return 0
+        await db.execute('DELETE FROM candles WHERE bucket >= ?', (start,))
+        cursor = await db.execute('''
+            SELECT ticker, CAST(strftime('%s', timestamp) AS INTEGER), price, amount
+            FROM transactions WHERE timestamp >= ? ORDER BY ticker, timestamp, id
+        ''', (time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(start)),))
+        while True:
+            chunk = await cursor.fetchmany(BACKFILL_CHUNK)
+            if not chunk:
+                break
+            count += len(chunk)
+            by_ticker = {}
+            for ticker, timestamp, price, amount in chunk:
+                by_ticker.setdefault(ticker, []).append((timestamp, price, amount))
+            for ticker, fills in by_ticker.items():
+                await db.executemany(UPSERT_CANDLE_SQL, candle_rows(ticker, fills))
+        await db.commit()
+    return count
+
+# Daily stats
+UPSERT_DAILY_STATS_SQL = '''
+    INSERT INTO daily_stats (day, ticker, volume, trades, traders, open_price, close_price, royalties)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (day, ticker) DO UPDATE SET
+        volume = volume + excluded.volume,
+        trades = trades + excluded.trades,
+        traders = traders + excluded.traders,
+        close_price = excluded.close_price,
+        royalties = royalties + excluded.royalties
+'''
+
+async def _add_daily_stats(db, ticker, fills):
+    # Traders are counted as they first show up in daily_traders on that day
+    for day, (volume, trades, open_price, close_price, royalties, user_ids) in daily_groups(fills).items():
+        cursor = await db.executemany('INSERT OR IGNORE INTO daily_traders (day, ticker, user_id) VALUES (?, ?, ?)',
+                                      [(day, ticker, user_id) for user_id in user_ids])
+        await db.execute(UPSERT_DAILY_STATS_SQL,
+                         (day, ticker, volume, trades, cursor.rowcount, open_price, close_price, royalties))
+
+async def get_daily_stats(day):
+    """Rows of (ticker, volume, trades, traders, open_price, close_price, royalties)
+    for one UTC day, by volume."""
+    async with connection() as db:
+        cursor = await db.execute('''
+            SELECT ticker, volume, trades, traders, open_price, close_price, royalties
+            FROM daily_stats WHERE day = ? ORDER BY volume DESC
+        ''', (day,))
+        return await cursor.fetchall()
+
+async def get_daily_creators(day, limit=10):
+    """Rows of (id, username, royalties) for the creators who earned most on one UTC day."""
+    async with connection() as db:
+        cursor = await db.execute('''
+            SELECT c.creator_id, u.username, SUM(d.royalties) AS earned
+            FROM daily_stats d JOIN coins c ON c.ticker = d.ticker LEFT JOIN users u ON u.id = c.creator_id
+            WHERE d.day = ? GROUP BY c.creator_id ORDER BY earned DESC LIMIT ?
+        ''', (day, limit))
+        return await cursor.fetchall()
+
+async def prune_daily_traders():
+    """Forget who traded on days older than TRADERS_KEEP_DAYS; their counts stay in daily_stats."""
+    async with connection() as db:
+        cursor = await db.execute('DELETE FROM daily_traders WHERE day < ?',
+                                  (day_of(time.time() - TRADERS_KEEP_DAYS * 86400),))
+        await db.commit()
+        return cursor.rowcount
+
+async def backfill_daily_stats(archived=False):
+    """Rebuild daily stats in one streaming pass over transactions; returns the
+    number of transactions read. Pass ``archived`` once the archive job has
+    run: only days from the first whole day left in the table are then
+    replaced, so archived days (and the one split with the archive) keep their
+    stats. Volumes and royalties come from the recorded fill prices, so they
+    can differ from the live ones by rounding. Holds the write lock
+    throughout, so run it while the bot is stopped."""
+    count = 0
+    async with connection() as db:
+        await db.execute('BEGIN IMMEDIATE')
+        start = await _backfill_start(db, archived)
+        if start is None:
+            await db.rollback()
+            return 0
+        await db.execute('DELETE FROM daily_stats WHERE day >= ?', (day_of(start),))
+        await db.execute('DELETE FROM daily_traders WHERE day >= ?', (day_of(start),))
+        cursor = await db.execute('''
+            SELECT t.ticker, CAST(strftime('%s', t.timestamp) AS INTEGER), t.price, t.amount, t.user_id, c.royalty_fee
+            FROM transactions t LEFT JOIN coins c ON c.ticker = t.ticker
+            WHERE t.timestamp >= ? ORDER BY t.ticker, t.timestamp, t.id
+        ''', (time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(start)),))
+        while True:
+            chunk = await cursor.fetchmany(BACKFILL_CHUNK)
+            if not chunk:
+                break
+            count += len(chunk)
+            by_ticker = {}
+            for ticker, timestamp, price, amount, user_id, royalty_fee in chunk:
+                total = price * amount // AMOUNT_SCALE
+                royalty = total * (royalty_fee or 0) // RATE_SCALE
+                by_ticker.setdefault(ticker, []).append((timestamp, price, total, royalty, user_id))
+            for ticker, fills in by_ticker.items():
+                await _add_daily_stats(db, ticker, fills)
+        await db.commit()
+    return count
+
+# Expired rows; table -> its key columns
+EXPIRING_TABLES = {
+    'inventory': 'id',
+    'duels': 'chat_id, message_id',
+}
+
+async def delete_expired(table, now, limit):
+    """Delete up to ``limit`` rows of ``table`` whose expires_at is ``now`` or
+    earlier, in one commit; returns how many went."""
+    key = EXPIRING_TABLES[table]
+    async with connection() as db:
+        cursor = await db.execute(f'''
+            DELETE FROM {table} WHERE ({key}) IN (
+                SELECT {key} FROM {table} WHERE expires_at <= ? ORDER BY expires_at LIMIT ?)
+        ''', (now, limit))
+        await db.commit()
+        return cursor.rowcount
+
+# Duels
+async def add_duel(chat_id, message_id, challenger_id, challenger_username, target_username, amount, expires_at):
+    async with connection() as db:
+        await db.execute('''
+            INSERT OR REPLACE INTO duels (chat_id, message_id, challenger_id, challenger_username, target_username, amount, expires_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (chat_id, message_id, challenger_id, challenger_username, target_username, amount, expires_at))
+        await db.commit()
+
+async def load_duels(now):
+    """Delete duels that expired by ``now`` and return the rest as (chat_id,
+    message_id, challenger_id, challenger_username, target_username, amount,
+    expires_at) rows."""
+    async with connection() as db:
+        await db.execute('DELETE FROM duels WHERE expires_at <= ?', (now,))
+        await db.commit()
+        cursor = await db.execute('SELECT * FROM duels')
+        return await cursor.fetchall()
+
+async def settle_duel(chat_id, message_id, challenger_id, accepter_id, amount, winner_id):
+    """Claim a pending duel and settle it in one transaction: the stake moves
+    from loser to winner (``winner_id`` None is a draw). Returns 'gone' if the
+    duel was already claimed, 'insufficient' if either player can no longer
+    cover the stake (the duel is dropped either way) or 'settled'."""
+    async with transaction() as tx:
+        cursor = await tx.db.execute('DELETE FROM duels WHERE chat_id = ? AND message_id = ?', (chat_id, message_id))
+        if not cursor.rowcount:
+            return 'gone'
+        cursor = await tx.db.execute('SELECT balance FROM users WHERE id IN (?, ?)', (challenger_id, accepter_id))
+        balances = [balance for balance, in await cursor.fetchall()]
+        if len(balances) < 2 or min(balances) < amount:
+            return 'insufficient'
+        if winner_id is not None:
+            loser_id = accepter_id if winner_id == challenger_id else challenger_id
+            await tx.add_balance(winner_id, amount)
+            await tx.add_balance(loser_id, -amount)
+        return 'settled'
+
 # Leaderboard
+async def get_equity_leaderboard(limit=10):
+    """Rows of (id, username, balance, equity) ranked by equity, in one query."""
+    async with connection() as db:
+        cursor = await db.execute(EQUITY_SQL + ' GROUP BY u.id ORDER BY equity DESC LIMIT ?', (limit,))
+        return await cursor.fetchall()
+
 async def get_top_users(limit=10):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+    async with connection() as db:
         cursor = await db.execute('SELECT id, username, balance, total_royalties FROM users ORDER BY balance DESC LIMIT ?', (limit,))
         return await cursor.fetchall()
 
 async def get_top_creators(limit=10):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+    async with connection() as db:
         cursor = await db.execute('SELECT id, username, total_royalties FROM users ORDER BY total_royalties DESC LIMIT ?', (limit,))
         return await cursor.fetchall()
 
 async def get_top_coins(limit=10):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+    async with connection() as db:
         cursor = await db.execute('SELECT ticker, total_volume FROM coins ORDER BY total_volume DESC LIMIT ?', (limit,))
         return await cursor.fetchall()
 
 async def get_user_balance(user_id):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+    async with connection() as db:
         cursor = await db.execute('SELECT balance FROM users WHERE id = ?', (user_id,))
         row = await cursor.fetchone()
         return row[0] if row else 0
 
 async def get_user_tokens(user_id):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+    async with connection() as db:
         cursor = await db.execute('SELECT ticker, amount FROM user_inventory WHERE user_id = ?', (user_id,))
         rows = await cursor.fetchall()
         return [{'name': row[0], 'amount': row[1]} for row in rows]
\ No newline at end of file
@@ -0,0 +1,63 @@
+import time
+from database import add_duel, load_duels, settle_duel
+from expiry import call_at
+
+# Open /dice challenges, keyed by (chat_id, message_id) of the bot message with
+# the accept button. They live in memory for lookups, in the duels table so
+# they survive restarts, and expire DUEL_TTL seconds after being offered: an
+# expiry timer drops them from memory on time and expiry.sweep() deletes the rows.
+DUEL_TTL = 600
+
+_duels = {}
+
+
+async def load():
+    """Reload the duels still open after a restart."""
+    now = int(time.time())
+    _duels.clear()
+    for chat_id, message_id, challenger_id, challenger_username, target_username, amount, expires_at in await load_duels(now):
+        _remember((chat_id, message_id), challenger_id, challenger_username, target_username, amount, expires_at)
+
+
+def _remember(key, challenger_id, challenger_username, target_username, amount, expires_at):
+    _duels[key] = {
+        'challenger': challenger_id,
+        'challenger_username': challenger_username,
+        'target_username': target_username,
+        'amount': amount,
+        'expires_at': expires_at,
+    }
+    call_at(expires_at, _forget, key, expires_at)
+
+
+async def add(chat_id, message_id, challenger_id, challenger_username, target_username, amount):
+    expires_at = int(time.time()) + DUEL_TTL
+    _remember((chat_id, message_id), challenger_id, challenger_username, target_username, amount, expires_at)
+    await add_duel(chat_id, message_id, challenger_id, challenger_username, target_username, amount, expires_at)
+
+
+def get(chat_id, message_id):
+    duel = _duels.get((chat_id, message_id))
+    if duel is None or duel['expires_at'] <= time.time():
+        return None
+    return duel
+
+
+def take(chat_id, message_id):
+    """Claim an open duel so no one else can accept it; None if it is gone."""
+    duel = get(chat_id, message_id)
+    if duel is not None:
+        del _duels[(chat_id, message_id)]
+    return duel
+
+
+async def settle(chat_id, message_id, duel, accepter_id, winner_id):
+    """Persist the outcome of a taken duel; see database.settle_duel."""
+    return await settle_duel(chat_id, message_id, duel['challenger'], accepter_id, duel['amount'], winner_id)
+
+
+def _forget(key, expires_at):
+    duel = _duels.get(key)
+    # Skip timers left behind by duels already taken or replaced
+    if duel is not None and duel['expires_at'] == expires_at:
+        del _duels[key]
@@ -0,0 +1,72 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import logging
+import time
+from database import EXPIRING_TABLES, delete_expired
+
+# Expiring state, in two halves. In memory, whatever caches something with an
+# expires_at (trigger words, open duels) registers a callback here; one min-heap
+# of deadlines and a single loop timer armed for the earliest run each callback
+# when its time comes, so nothing is ever served past its expiry and nothing
+# is scanned to find what expired. On disk, sweep() runs from the scheduler and
+# deletes expired rows in batches of SWEEP_BATCH, so tables hold live rows only.
+# All times are unix seconds.
+SWEEP_BATCH = 1000
+
+_timers = []  # (expires_at, seq, callback, args)
+_seq = itertools.count()
+_handle = None
+
+
+def call_at(expires_at, callback, *args):
+    """Run ``callback(*args)`` once the clock reaches ``expires_at``; a
+    coroutine it returns is run as a task. Callbacks can't be cancelled, so
+    they should check the entry is still the one they were registered for."""
+    seq = next(_seq)
+    heapq.heappush(_timers, (expires_at, seq, callback, args))
+    if _timers[0][1] == seq:
+        _arm()
+
+
+def _arm():
+    global _handle
+    if _handle is not None:
+        _handle.cancel()
+        _handle = None
+    if _timers:
+        _handle = asyncio.get_running_loop().call_later(max(0.0, _timers[0][0] - time.time()), _fire,
+                                                        context=contextvars.Context())
+
+
+def _fire():
+    global _handle
+    _handle = None
+    # Re-checked against the wall clock, which may have moved since arming
+    now = time.time()
+    while _timers and _timers[0][0] <= now:
+        _, _, callback, args = heapq.heappop(_timers)
+        try:
+            result = callback(*args)
+            if asyncio.iscoroutine(result):
+                asyncio.create_task(result)
+        except Exception:
+            logging.exception("Expiry callback %r failed", callback)
+    _arm()
+
+
+async def sweep():
+    """Delete every row that has expired from the EXPIRING_TABLES, one batch
+    per transaction so other writers get in between."""
+    now = int(time.time())
+    deleted = 0
+    for table in EXPIRING_TABLES:
+        while True:
+            count = await delete_expired(table, now, SWEEP_BATCH)
+            deleted += count
+            if count < SWEEP_BATCH:
+                break
+    if deleted:
+        logging.info("Deleted %d expired rows", deleted)
+    return deleted
@@ -2,15 +2,22 @@ import random
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.filters import Command
-from database import get_user, create_user, get_balance, update_balance, get_global_var, set_global_var, get_user_by_username, get_address
+from database import get_user, create_user, get_balance, update_balance, get_user_by_username, get_address
 from config import ADMIN_ID
+from money import MONEY_SCALE, to_money, format_money
+import duels
+import treasury
 
 router = Router()
 
-# Store pending duels: {message_id: {'challenger': id, 'target': id, 'amount': amount}}
-pending_duels = {}
+# Game rules (simulator.py replays these)
+DICE_SIDES = 6
+ROB_SUCCESS_CHANCE = 0.3
+ROB_MAX_SHARE = 0.1  # of the target's balance
+ROB_PENALTY_RANGE = (10, 100)  # coins, before the multiplier
+ROB_PENALTY_MULTIPLIER = 2
 
-@router.message(F.text.startswith("/dice"))
+@router.message(Command("dice"))
 async def cmd_dice(message: Message):
     args = message.text.split()
     if len(args) != 3:
@@ -18,7 +25,7 @@ async def cmd_dice(message: Message):
         return
     
     try:
-        amount = float(args[1])
+        amount = to_money(args[1])
         if amount <= 0:
             raise ValueError
     except ValueError:
@@ -46,46 +53,39 @@ async def cmd_dice(message: Message):
     
     # Create inline keyboard
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="Прийняти парі", callback_data=f"accept_duel:{challenger_id}:{amount}:{username}")]
+        [InlineKeyboardButton(text="Прийняти парі", callback_data="accept_duel:")]
     ])
     
-    await message.reply(f"@{challenger_username} пропонує парі на {amount} монет з @{username}!", reply_markup=keyboard)
+    offer = await message.reply(f"@{challenger_username} пропонує парі на {format_money(amount)} монет з @{username}!", reply_markup=keyboard)
     
-    # Store pending
-    pending_duels[message.message_id] = {'challenger': challenger_id, 'target_username': username, 'amount': amount, 'challenger_username': challenger_username}
+    # Store pending, keyed by the message the button is on
+    await duels.add(offer.chat.id, offer.message_id, challenger_id, challenger_username, username, amount)
 
 @router.callback_query(F.data.startswith("accept_duel:"))
 async def accept_duel(callback: CallbackQuery):
-    data = callback.data.split(":")
-    challenger_id = int(data[1])
-    amount = float(data[2])
-    target_username = data[3]
-    
+    chat_id = callback.message.chat.id
+    message_id = callback.message.message_id
     accepter_id = callback.from_user.id
     accepter_username = callback.from_user.username
     
-    if accepter_username != target_username:
-        await callback.answer("Це не для вас!")
-        return
-    
     # Check if pending
-    if callback.message.message_id not in pending_duels:
+    duel = duels.get(chat_id, message_id)
+    if duel is None:
         await callback.answer("Парі вже не актуальна")
         return
     
-    duel = pending_duels.pop(callback.message.message_id)
-    
-    # Check balances
-    chal_bal = await get_balance(challenger_id)
-    acc_bal = await get_balance(accepter_id)
-    
-    if chal_bal < amount or acc_bal < amount:
-        await callback.message.edit_text("Один з гравців не має достатньо коштів")
+    if accepter_username != duel['target_username']:
+        await callback.answer("Це не для вас!")
         return
     
+    # Claimed before any await, so a double tap can't settle twice
+    duel = duels.take(chat_id, message_id)
+    challenger_id = duel['challenger']
+    amount = duel['amount']
+    
     # Roll dice
-    chal_dice = random.randint(1, 6)
-    acc_dice = random.randint(1, 6)
+    chal_dice = random.randint(1, DICE_SIDES)
+    acc_dice = random.randint(1, DICE_SIDES)
     
     if chal_dice > acc_dice:
         winner = challenger_id
@@ -98,23 +98,30 @@ async def accept_duel(callback: CallbackQuery):
         winner_name = accepter_username
         loser_name = duel['challenger_username']
     else:
+        winner = None
+    
+    # Both balances are checked and the stake moved in one transaction
+    outcome = await duels.settle(chat_id, message_id, duel, accepter_id, winner)
+    if outcome == 'gone':
+        await callback.answer("Парі вже не актуальна")
+        return
+    if outcome == 'insufficient':
+        await callback.message.edit_text("Один з гравців не має достатньо коштів")
+        return
+    if winner is None:
         # Draw, refund
         await callback.message.edit_text(f"Нічия! {chal_dice} vs {acc_dice}. Гроші повернуто.")
         return
     
-    # Update balances
-    await update_balance(winner, amount)
-    await update_balance(loser, -amount)
-    
     new_winner_bal = await get_balance(winner)
     new_loser_bal = await get_balance(loser)
     
     await callback.message.edit_text(f"🎲 Результат: {winner_name} виграв! ({chal_dice} vs {acc_dice})\n"
-                                     f"Забрано {amount} монет.\n"
-                                     f"{winner_name} тепер має {new_winner_bal} монет.\n"
-                                     f"{loser_name} тепер має {new_loser_bal} монет.")
+                                     f"Забрано {format_money(amount)} монет.\n"
+                                     f"{winner_name} тепер має {format_money(new_winner_bal)} монет.\n"
+                                     f"{loser_name} тепер має {format_money(new_loser_bal)} монет.")
 
-@router.message(F.text.startswith("/dice_bot"))
+@router.message(Command("dice_bot"))
 async def cmd_dice_bot(message: Message):
     args = message.text.split()
     if len(args) != 2:
@@ -122,7 +129,7 @@ async def cmd_dice_bot(message: Message):
         return
     
     try:
-        amount = float(args[1])
+        amount = to_money(args[1])
         if amount <= 0:
             raise ValueError
     except ValueError:
@@ -135,30 +142,29 @@ async def cmd_dice_bot(message: Message):
         await message.reply("Insufficient balance")
         return
     
-    bot_bal = float(await get_global_var('bot_balance') or 0)
-    if bot_bal < amount:
+    if not treasury.can_cover(amount):
         await message.reply("Я банкрут, зачекайте поки хтось програє")
         return
     
-    # Roll
-    user_dice = random.randint(1, 6)
-    bot_dice = random.randint(1, 6)
+    # Roll; the treasury is settled before any await so concurrent games can't overdraw it
+    user_dice = random.randint(1, DICE_SIDES)
+    bot_dice = random.randint(1, DICE_SIDES)
     
     if user_dice > bot_dice:
         # User wins
+        treasury.add(-amount)
         await update_balance(user_id, amount)
-        await set_global_var('bot_balance', str(bot_bal - amount))
         result = f"Ти виграв! {user_dice} vs {bot_dice}"
     elif bot_dice > user_dice:
         # Bot wins
+        treasury.add(amount)
         await update_balance(user_id, -amount)
-        await set_global_var('bot_balance', str(bot_bal + amount))
         result = f"Ти програв! {user_dice} vs {bot_dice}"
     else:
         result = f"Нічия! {user_dice} vs {bot_dice}"
     
     new_bal = await get_balance(user_id)
-    await message.reply(f"🎲 {result}\n{await get_address(user_id)}, твій баланс: {new_bal}")
+    await message.reply(f"🎲 {result}\n{await get_address(user_id)}, твій баланс: {format_money(new_bal)}")
 
 @router.message(F.text.startswith("/rob"))
 async def cmd_rob(message: Message):
@@ -180,13 +186,6 @@ async def cmd_rob(message: Message):
     # Assume target_id is the id of the user with that username.
     # But to get id by username, need to query db.
     
-    # Add a function to get user by username
-    async def get_user_by_username(username):
-        async with aiosqlite.connect('casino_bot.db') as db:
-            cursor = await db.execute('SELECT id FROM users WHERE username = ?', (username,))
-            row = await cursor.fetchone()
-            return row[0] if row else None
-    
     target_id = await get_user_by_username(target_username)
     if not target_id:
         await message.reply("Користувач не знайдений")
@@ -197,21 +196,21 @@ async def cmd_rob(message: Message):
         return
     
     # Chance 30%
-    if random.random() < 0.3:
+    if random.random() < ROB_SUCCESS_CHANCE:
         # Success, steal random amount
         target_bal = await get_balance(target_id)
-        steal_amount = random.uniform(1, target_bal * 0.1)  # up to 10%
+        steal_amount = round(random.uniform(MONEY_SCALE, target_bal * ROB_MAX_SHARE))  # up to 10%
         await update_balance(robber_id, steal_amount)
         await update_balance(target_id, -steal_amount)
-        await message.reply(f"Успіх! {await get_address(robber_id)}, ви вкрали {steal_amount:.2f} монет")
+        await message.reply(f"Успіх! {await get_address(robber_id)}, ви вкрали {format_money(steal_amount)} монет")
     else:
         # Failure, penalty x2, but x2 of what? Perhaps x2 of intended steal, but since random, perhaps fixed penalty.
         # The task says "штраф x2", but x2 of what? Perhaps x2 of the amount they would steal, but since failed, maybe x2 random.
         # Let's assume penalty is x2 of a random amount they tried to steal.
-        penalty = random.uniform(10, 100) * 2
+        penalty = round(random.uniform(*ROB_PENALTY_RANGE) * ROB_PENALTY_MULTIPLIER * MONEY_SCALE)
         bal = await get_balance(robber_id)
         if bal >= penalty:
             await update_balance(robber_id, -penalty)
-            await message.reply(f"Невдача! {await get_address(robber_id)}, штраф {penalty:.2f} монет")
+            await message.reply(f"Невдача! {await get_address(robber_id)}, штраф {format_money(penalty)} монет")
         else:
             await message.reply(f"Невдача! {await get_address(robber_id)}, але у вас недостатньо коштів для штрафу")
\ No newline at end of file
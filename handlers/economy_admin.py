@@ -1,8 +1,10 @@
 from aiogram import Router, F
 from aiogram.types import Message
 from aiogram.filters import Command
-from database import update_balance, set_global_var, get_global_var, set_balance
+from database import update_balance, set_balance
 from config import ADMIN_ID
+from money import to_money
+import treasury
 
 router = Router()
 
@@ -18,7 +20,7 @@ async def admin_set_balance(message: Message):
     
     try:
         user_id = int(args[1])
-        amount = float(args[2])
+        amount = to_money(args[2])
     except ValueError:
         await message.reply("Invalid args")
         return
@@ -45,10 +47,10 @@ async def admin_set_bot_balance(message: Message):
         return
     
     try:
-        amount = float(args[1])
+        amount = to_money(args[1])
     except ValueError:
         await message.reply("Invalid amount")
         return
     
-    await set_global_var('bot_balance', str(amount))
+    await treasury.set_balance(amount)
     await message.reply("Bot balance set")
\ No newline at end of file
@@ -1,10 +1,11 @@
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.filters import Command
-from database import get_balance, update_balance, create_coin, get_coin, get_coin_price, add_to_inventory, remove_from_inventory, add_transaction, update_coin_supply, update_coin_volume, update_royalties, get_user_tokens, get_top_users, get_top_creators, get_top_coins, get_address, get_user_by_username, get_global_var, set_global_var
+from database import get_balance, update_balance, create_coin, get_coin, get_user_tokens, get_equity_leaderboard, get_address, get_user_by_username, TradeError
 from config import ADMIN_ID
-from decimal import Decimal
-from decimal import Decimal
+from money import AMOUNT_SCALE, to_money, to_amount, to_rate, format_money, format_amount
+from pricing import spot_price, get_curve
+from order_queue import submit_order
 
 router = Router()
 
@@ -28,7 +29,7 @@ async def cmd_give(message: Message):
     
     target = args[1]
     try:
-        amount = float(args[2])
+        amount = to_money(args[2])
     except ValueError:
         await message.reply("Invalid amount")
         return
@@ -48,9 +49,9 @@ async def cmd_give(message: Message):
             return
     
     await update_balance(user_id, amount)
-    print(f"Gave {amount} to {user_id}")
+    print(f"Gave {format_money(amount)} to {user_id}")
     try:
-        await message.reply(f"Gave {amount} coins to user {target}")
+        await message.reply(f"Gave {format_money(amount)} coins to user {target}")
         print("Reply sent")
     except Exception as e:
         print(f"Error sending reply: {e}")
@@ -74,7 +75,9 @@ async def cmd_create_coin(message: Message):
     
     ticker = args[1].upper()
     try:
-        initial_price = float(args[2])
+        initial_price = to_money(args[2])
+        if initial_price <= 0:
+            raise ValueError
     except ValueError:
         await message.reply("Invalid price")
         return
@@ -99,12 +102,12 @@ async def cmd_create_coin(message: Message):
 async def create_tier(callback: CallbackQuery):
     data = callback.data.split(":")
     ticker = data[1]
-    initial_price = float(data[2])
+    initial_price = int(data[2])
     tier = data[3]
     
     user_id = callback.from_user.id
     tier_info = TIERS[tier]
-    cost = tier_info["cost"]
+    cost = to_money(tier_info["cost"])
     
     bal = await get_balance(user_id)
     if bal < cost:
@@ -112,10 +115,17 @@ async def create_tier(callback: CallbackQuery):
         return
     
     await update_balance(user_id, -cost)
-    await create_coin(ticker, user_id, initial_price, tier, tier_info["fee"], tier_info["bot_fee"])
+    await create_coin(ticker, user_id, initial_price, tier, to_rate(tier_info["fee"]), to_rate(tier_info["bot_fee"]))
     
     await callback.message.edit_text(f"Created coin ${ticker} with tier {tier}!")
 
+TRADE_ERRORS = {
+    'not_found': "Coin not found",
+    'invalid_amount': "Invalid amount",
+    'insufficient_balance': "Insufficient balance",
+    'insufficient_tokens': "Insufficient holdings",
+}
+
 @router.message(F.text.startswith("/buy"))
 async def cmd_buy(message: Message):
     args = message.text.split()
@@ -125,57 +135,22 @@ async def cmd_buy(message: Message):
     
     ticker = args[1].upper()
     try:
-        amount = float(args[2])
+        amount = to_amount(args[2])
     except ValueError:
         await message.reply("Invalid amount")
         return
     
     user_id = message.from_user.id
-    coin = await get_coin(ticker)
-    if not coin:
-        await message.reply("Coin not found")
-        return
-    
-    price = await get_coin_price(ticker)
-    total_cost = price * Decimal(str(amount))
-    
-    bal = await get_balance(user_id)
-    if bal < float(total_cost):
-        await message.reply("Insufficient balance")
+    try:
+        trade = await submit_order(user_id, ticker, 'buy', amount)
+    except TradeError as e:
+        await message.reply(TRADE_ERRORS[e.reason])
         return
     
-    # Update supply
-    new_supply = Decimal(str(coin[3])) + Decimal(str(amount))
-    await update_coin_supply(ticker, float(new_supply))
-    
-    # Update volume
-    await update_coin_volume(ticker, float(total_cost))
-    
-    # Deduct balance
-    await update_balance(user_id, -float(total_cost))
-    
-    # Add to inventory
-    await add_to_inventory(user_id, ticker, amount)
-    
-    # Add transaction
-    await add_transaction(user_id, ticker, 'buy', amount, float(price))
-    
-    # Royalties
-    royalty = total_cost * Decimal(str(coin[6]))  # royalty_fee
-    bot_fee = total_cost * Decimal(str(coin[7]))  # bot_fee
-    creator_id = coin[1]
-    await update_royalties(creator_id, float(royalty))
-    # Bot fee to bot_balance
-    from database import set_global_var, get_global_var
-    bot_bal = float(await get_global_var('bot_balance') or 0)
-    await set_global_var('bot_balance', str(bot_bal + float(bot_fee)))
-    
-    new_price = await get_coin_price(ticker)
-    creator_username = (await get_user_by_username(await get_user(creator_id)[1]))[1] if await get_user(creator_id) else "Unknown"
-    
-    await message.reply(f"{await get_address(user_id)} bought {amount} ${ticker}. Price rose to {new_price:.4f}. Creator @{creator_username} got {royalty:.4f} coins royalty!")
+    creator_username = trade['creator_username'] or "Unknown"
+    await message.reply(f"{await get_address(user_id)} bought {format_amount(amount)} ${ticker} at {format_money(trade['price'], 4)}. Price rose to {format_money(trade['new_price'], 4)}. Creator @{creator_username} got {format_money(trade['royalty'], 4)} coins royalty!")
 
-@router.message(F.text.lower().startswith("/help"))
+@router.message(F.text.startswith("/sell"))
 async def cmd_sell(message: Message):
     args = message.text.split()
     if len(args) != 3:
@@ -184,50 +159,20 @@ async def cmd_sell(message: Message):
     
     ticker = args[1].upper()
     try:
-        amount = float(args[2])
+        amount = to_amount(args[2])
     except ValueError:
         await message.reply("Invalid amount")
         return
     
     user_id = message.from_user.id
-    holdings = await get_user_tokens(user_id)
-    holding = next((h for h in holdings if h[0] == ticker), None)
-    if not holding or holding[1] < amount:
-        await message.reply("Insufficient holdings")
+    try:
+        trade = await submit_order(user_id, ticker, 'sell', amount)
+    except TradeError as e:
+        await message.reply(TRADE_ERRORS[e.reason])
         return
     
-    coin = await get_coin(ticker)
-    price = await get_coin_price(ticker)
-    total_value = price * Decimal(str(amount))
-    
-    # Update supply
-    new_supply = Decimal(str(coin[3])) - Decimal(str(amount))
-    await update_coin_supply(ticker, float(new_supply))
-    
-    # Update volume
-    await update_coin_volume(ticker, float(total_value))
-    
-    # Add balance
-    await update_balance(user_id, float(total_value))
-    
-    # Remove from inventory
-    await remove_from_inventory(user_id, ticker, amount)
-    
-    # Add transaction
-    await add_transaction(user_id, ticker, 'sell', amount, float(price))
-    
-    # Royalties on sell too?
-    royalty = total_value * Decimal(str(coin[6]))
-    bot_fee = total_value * Decimal(str(coin[7]))
-    creator_id = coin[1]
-    await update_royalties(creator_id, float(royalty))
-    bot_bal = float(await get_global_var('bot_balance') or 0)
-    await set_global_var('bot_balance', str(bot_bal + float(bot_fee)))
-    
-    new_price = await get_coin_price(ticker)
-    creator_username = (await get_user(creator_id))[1] if await get_user(creator_id) else "Unknown"
-    
-    await message.reply(f"{await get_address(user_id)} sold {amount} ${ticker}. Price fell to {new_price:.4f}. Creator @{creator_username} got {royalty:.4f} coins royalty!")
+    creator_username = trade['creator_username'] or "Unknown"
+    await message.reply(f"{await get_address(user_id)} sold {format_amount(amount)} ${ticker} at {format_money(trade['price'], 4)}. Price fell to {format_money(trade['new_price'], 4)}. Creator @{creator_username} got {format_money(trade['royalty'], 4)} coins royalty!")
 
 @router.message(F.text.startswith("/my_tokens"))
 async def cmd_my_tokens(message: Message):
@@ -238,22 +183,23 @@ async def cmd_my_tokens(message: Message):
         return
     
     text = "Your tokens:\n"
-    total_value = Decimal('0')
-    for ticker, amount in holdings:
-        price = await get_coin_price(ticker)
-        value = price * Decimal(str(amount))
+    total_value = 0
+    for token in holdings:
+        ticker, amount = token['name'], token['amount']
+        curve = get_curve(ticker)
+        price = spot_price(*curve) if curve else 0
+        value = price * amount // AMOUNT_SCALE
         total_value += value
-        text += f"${ticker}: {amount} (value: {value:.4f})\n"
+        text += f"${ticker}: {format_amount(amount)} (value: {format_money(value, 4)})\n"
     
-    text += f"Total token value: {total_value:.4f}"
+    text += f"Total token value: {format_money(total_value, 4)}"
     await message.reply(text)
 
 @router.message(F.text.startswith("/top"))
 async def cmd_top(message: Message):
-    top_users = await get_top_users(5)
-    text = "Top by balance:\n"
-    for i, (id, username, balance, royalties) in enumerate(top_users, 1):
-        equity = await get_total_equity(id)
-        text += f"{i}. @{username}: {balance:.2f} coins, Equity: {equity:.2f}\n"
+    top_users = await get_equity_leaderboard(5)
+    text = "Top by equity:\n"
+    for i, (id, username, balance, equity) in enumerate(top_users, 1):
+        text += f"{i}. @{username}: {format_money(balance)} coins, Equity: {format_money(equity)}\n"
     
     await message.reply(text)
\ No newline at end of file
@@ -1,9 +1,10 @@
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.filters import Command
-from database import get_balance, update_balance, add_inventory, set_vip, set_title, get_inventory, get_address
-from datetime import datetime, timedelta
-import aiosqlite
+from database import get_balance, update_balance, add_inventory, set_vip, set_title, get_inventory, get_address, get_active_triggers
+import time
+from money import to_money
+from trigger_matcher import matcher
 
 router = Router()
 
@@ -71,7 +72,7 @@ async def buy_item(callback: CallbackQuery):
         await callback.answer("Товар не знайдено")
         return
     
-    price = item_info['price']
+    price = to_money(item_info['price'])
     bal = await get_balance(user_id)
     if bal < price:
         await callback.answer("Недостатньо коштів")
@@ -91,31 +92,21 @@ async def buy_item(callback: CallbackQuery):
         # For Effects, Items
         expires_at = None
         if item_info['duration']:
-            expires_at = datetime.now() + timedelta(seconds=item_info['duration'])
+            expires_at = int(time.time()) + item_info['duration']
         await add_inventory(user_id, category, item_name, expires_at)
+        if category == 'Effects':
+            matcher.add(item_name, user_id, expires_at)
     
     await callback.answer(f"Куплено {item_name}!")
     await callback.message.edit_text(f"{await get_address(user_id)}, покупка успішна!")
 
 # Handler for trigger words
-@router.message()
+@router.message(F.text, ~F.text.startswith('/'))
 async def check_triggers(message: Message):
-    if not message.text:
-        return
-    if message.text.startswith('/'):
-        return
-    
-    text = message.text.lower()
-    # Get all active trigger words
-    # This is inefficient, but for demo
-    # In real, perhaps cache or separate table
-    async with aiosqlite.connect('casino_bot.db') as db:
-        cursor = await db.execute('SELECT user_id, item_name FROM inventory WHERE item_type = ? AND (expires_at IS NULL OR expires_at > ?)',
-                                  ('Effects', datetime.now()))
-        triggers = await cursor.fetchall()
-    
-    for user_id, trigger in triggers:
-        if trigger.lower() in text:
-            # Trigger activated, send something
-            await message.reply("🔥 Trigger activated!")  # Or sticker, but need id
-            break  # Or handle multiple
\ No newline at end of file
+    # Active trigger words live in an in-memory automaton, so no DB access here
+    if matcher.match(message.text):
+        # Trigger activated, send something
+        await message.reply("🔥 Trigger activated!")  # Or sticker, but need id
+
+async def load_triggers():
+    matcher.load(await get_active_triggers())
\ No newline at end of file
@@ -0,0 +1,124 @@
+import asyncio
+import logging
+from fastapi import WebSocket, WebSocketDisconnect
+from database import add_user_listener, get_user_snapshot
+from money import money_value, amount_value
+from pricing import spot_price, get_curve
+
+# Mini-app connections get a frame when their user's balance or holdings
+# change and when a ticker they hold trades. Changes are only flagged on the
+# connection; its sender waits COALESCE_DELAY after the first one, so a burst
+# of trades goes out as one frame with the latest values.
+COALESCE_DELAY = 0.1
+
+_by_user = {}    # user_id -> set of subscribers
+_by_ticker = {}  # ticker -> set of subscribers holding it
+
+
+class _Subscriber:
+    def __init__(self, websocket, user_id):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.tickers = set()
+        self.user_changed = False
+        self.prices = {}
+        self.wakeup = asyncio.Event()
+
+    def notify_user(self):
+        self.user_changed = True
+        self.wakeup.set()
+
+    def notify_price(self, ticker, price):
+        self.prices[ticker] = price
+        self.wakeup.set()
+
+
+def _on_user_change(user_id):
+    for subscriber in _by_user.get(user_id, ()):
+        subscriber.notify_user()
+
+
+add_user_listener(_on_user_change)
+
+
+def publish_price(ticker, price):
+    """Fan a new spot price (money units) out to everyone holding ``ticker``."""
+    for subscriber in _by_ticker.get(ticker, ()):
+        subscriber.notify_price(ticker, price)
+
+
+def _watch(subscriber, tickers):
+    for ticker in subscriber.tickers - tickers:
+        watchers = _by_ticker[ticker]
+        watchers.discard(subscriber)
+        if not watchers:
+            del _by_ticker[ticker]
+    for ticker in tickers - subscriber.tickers:
+        _by_ticker.setdefault(ticker, set()).add(subscriber)
+    subscriber.tickers = tickers
+
+
+async def _next_frame(subscriber):
+    frame = {}
+    if subscriber.user_changed:
+        subscriber.user_changed = False
+        snapshot = await get_user_snapshot(subscriber.user_id)
+        if snapshot is not None:
+            balance, tokens = snapshot
+            frame['balance'] = money_value(balance)
+            frame['tokens'] = [{'name': token['name'], 'amount': amount_value(token['amount'])} for token in tokens]
+            held = {token['name'] for token in tokens}
+            for ticker in held - subscriber.tickers:
+                # Newly held tickers start with their current price
+                curve = get_curve(ticker)
+                if curve is not None:
+                    subscriber.prices.setdefault(ticker, spot_price(*curve))
+            _watch(subscriber, held)
+    prices, subscriber.prices = subscriber.prices, {}
+    prices = {ticker: money_value(price) for ticker, price in prices.items() if ticker in subscriber.tickers}
+    if prices:
+        frame['prices'] = prices
+    return frame
+
+
+async def _send_loop(subscriber):
+    while True:
+        await subscriber.wakeup.wait()
+        await asyncio.sleep(COALESCE_DELAY)
+        subscriber.wakeup.clear()
+        frame = await _next_frame(subscriber)
+        if frame:
+            await subscriber.websocket.send_json(frame)
+
+
+async def _receive_loop(websocket):
+    # Clients don't send anything; reading is how a disconnect is noticed
+    try:
+        while True:
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        pass
+
+
+async def serve(websocket: WebSocket, user_id):
+    """Run one mini-app connection until either side closes it. The first
+    frame is a full snapshot of the user's balance, holdings and prices."""
+    await websocket.accept()
+    subscriber = _Subscriber(websocket, user_id)
+    _by_user.setdefault(user_id, set()).add(subscriber)
+    subscriber.notify_user()
+    tasks = {asyncio.create_task(_send_loop(subscriber)), asyncio.create_task(_receive_loop(websocket))}
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            error = task.exception()
+            if error is not None and not isinstance(error, WebSocketDisconnect):
+                logging.warning("Live update connection for %s closed: %r", user_id, error)
+    finally:
+        for task in tasks:
+            task.cancel()
+        _watch(subscriber, set())
+        subscribers = _by_user[user_id]
+        subscribers.discard(subscriber)
+        if not subscribers:
+            del _by_user[user_id]
@@ -0,0 +1,310 @@
+import argparse
+import asyncio
+import itertools
+import logging
+import os
+import random
+import shutil
+import tempfile
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.types import Message
+import database
+import query_profiler
+from config import QUERY_PROFILING
+from database import connection, set_treasury_balance
+from handlers.market_logic import TIERS
+from money import MONEY_SCALE, AMOUNT_SCALE, to_rate
+
+# Throughput harness: synthetic Telegram updates are fed straight into the
+# bot's Dispatcher (main.build_dispatcher) against a freshly seeded database.
+# The Bot talks to FakeSession, so no request leaves the process; what is
+# measured is our handlers, middlewares and SQLite.
+#
+#   python loadtest.py --updates 20000 --users 5000 --coins 200 --concurrency 50
+CHAT_ID = -1001000000000
+TOKEN = '123456:LOADTEST'
+
+# Relative weight of each kind of traffic; see Traffic for what each one sends
+MIX = {
+    'chatter': 30,
+    'buy': 12,
+    'sell': 6,
+    'my_tokens': 6,
+    'top': 4,
+    'help': 3,
+    'dice_bot': 10,
+    'duel': 6,
+    'rob': 5,
+    'shop': 6,
+    'create_coin': 2,
+}
+
+WORDS = ('gm', 'to the moon', 'rekt', 'hodl', 'who is buying', 'wen lambo', 'trigger word', 'lol', 'ну що там', 'казино')
+PERCENTILES = (50, 95, 99)
+
+
+class FakeSession(BaseSession):
+    """Bot API session that answers every call locally: methods returning a
+    Message get one with a fresh message_id, everything else gets True.
+    Which message answered which is kept in ``replies`` so scenarios can press
+    buttons on the bot's own messages."""
+
+    def __init__(self):
+        super().__init__()
+        self.calls = Counter()
+        self.replies = {}  # (chat_id, replied-to message_id) -> message_id
+        self._message_ids = itertools.count(1)
+
+    async def make_request(self, bot, method, timeout=None):
+        self.calls[type(method).__name__] += 1
+        if method.__returning__ is not Message:
+            return True
+        message_id = next(self._message_ids)
+        reply_to = getattr(method, 'reply_to_message_id', None)
+        if reply_to is None and getattr(method, 'reply_parameters', None):
+            reply_to = method.reply_parameters.message_id
+        if reply_to is not None:
+            self.replies[(method.chat_id, reply_to)] = message_id
+        return Message.model_validate({
+            'message_id': message_id,
+            'date': datetime.now(),
+            'chat': {'id': method.chat_id, 'type': 'supergroup'},
+            'text': getattr(method, 'text', None),
+        }, context={'bot': bot})
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        raise NotImplementedError('FakeSession does not download files')
+        yield b''
+
+    async def close(self):
+        pass
+
+
+class HandlerTimer(BaseMiddleware):
+    """Inner middleware timing each handler call by the handler's name."""
+
+    def __init__(self, timings):
+        self.timings = timings
+
+    async def __call__(self, handler, event, data):
+        name = data['handler'].callback.__qualname__
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            self.timings[name].append(time.perf_counter() - started)
+
+
+async def seed(users, coins, triggers, rng):
+    """Fill an empty database with ``users`` users, ``coins`` coins spread
+    over the tiers with holdings that add up to their supply, and
+    ``triggers`` active trigger words."""
+    tiers = list(TIERS)
+    holdings = defaultdict(int)
+    user_rows = [(user_id, f'user{user_id}', rng.randint(1_000, 100_000) * MONEY_SCALE) for user_id in range(1, users + 1)]
+    for user_id in range(1, users + 1):
+        for ticker in rng.sample(range(coins), min(3, coins)):
+            holdings[(user_id, f'T{ticker}')] = rng.randint(1, 50) * AMOUNT_SCALE
+    supply = Counter()
+    for (_, ticker), amount in holdings.items():
+        supply[ticker] += amount
+    coin_rows = []
+    for ticker in range(coins):
+        tier = rng.choice(tiers)
+        coin_rows.append((f'T{ticker}', rng.randint(1, users), rng.randint(1, 100) * MONEY_SCALE // 10, supply[f'T{ticker}'],
+                          tier, to_rate(TIERS[tier]['fee']), to_rate(TIERS[tier]['bot_fee'])))
+    expires_at = int(time.time()) + 86400
+    async with connection() as db:
+        await db.executemany('INSERT INTO users (id, username, balance) VALUES (?, ?, ?)', user_rows)
+        await db.executemany('''
+            INSERT INTO coins (ticker, creator_id, initial_price, current_supply, tier, royalty_fee, bot_fee)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', coin_rows)
+        await db.executemany('INSERT INTO user_inventory (user_id, ticker, amount) VALUES (?, ?, ?)',
+                             [(user_id, ticker, amount) for (user_id, ticker), amount in holdings.items()])
+        await db.executemany('INSERT INTO inventory (user_id, item_type, item_name, expires_at) VALUES (?, ?, ?, ?)',
+                             [(rng.randint(1, users), 'Effects', 'Trigger Word', expires_at) for _ in range(triggers)])
+        await db.commit()
+    await set_treasury_balance(10_000_000 * MONEY_SCALE)
+
+
+class Traffic:
+    """Builds raw Telegram updates. Each scenario is a generator of update
+    dicts; the next one is built only after the previous was handled, so
+    a scenario can answer the bot (accepting a duel, choosing a tier)."""
+
+    def __init__(self, users, coins, session, rng):
+        self.users = users
+        self.coins = coins
+        self.session = session
+        self.rng = rng
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1_000_000_000)
+        self._new_tickers = itertools.count()
+
+    def _user(self, user_id):
+        return {'id': user_id, 'is_bot': False, 'first_name': f'User {user_id}', 'username': f'user{user_id}'}
+
+    def message(self, user_id, text):
+        return {'update_id': next(self._update_ids), 'message': {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': CHAT_ID, 'type': 'supergroup'},
+            'from': self._user(user_id),
+            'text': text,
+        }}
+
+    def callback(self, user_id, data, message_id):
+        return {'update_id': next(self._update_ids), 'callback_query': {
+            'id': str(next(self._update_ids)),
+            'from': self._user(user_id),
+            'chat_instance': str(CHAT_ID),
+            'data': data,
+            'message': {'message_id': message_id, 'date': int(time.time()), 'chat': {'id': CHAT_ID, 'type': 'supergroup'}, 'text': '…'},
+        }}
+
+    def _answer_to(self, update):
+        return self.session.replies.get((CHAT_ID, update['message']['message_id']))
+
+    def scenario(self, kind):
+        rng = self.rng
+        user_id = rng.randint(1, self.users)
+        ticker = f'T{rng.randrange(self.coins)}'
+        if kind == 'chatter':
+            yield self.message(user_id, ' '.join(rng.choices(WORDS, k=rng.randint(1, 4))))
+        elif kind in ('buy', 'sell'):
+            yield self.message(user_id, f'/{kind} {ticker} {rng.randint(1, 5)}')
+        elif kind in ('my_tokens', 'top', 'help'):
+            yield self.message(user_id, f'/{kind}')
+        elif kind == 'dice_bot':
+            yield self.message(user_id, f'/dice_bot {rng.randint(1, 100)}')
+        elif kind == 'rob':
+            yield self.message(user_id, f'/rob @user{rng.randint(1, self.users)}')
+        elif kind == 'duel':
+            target = rng.randint(1, self.users)
+            offer = self.message(user_id, f'/dice {rng.randint(1, 100)} @user{target}')
+            yield offer
+            message_id = self._answer_to(offer)
+            if message_id is not None:
+                yield self.callback(target, 'accept_duel:', message_id)
+        elif kind == 'shop':
+            shop = self.message(user_id, '/shop')
+            yield shop
+            message_id = self._answer_to(shop)
+            if message_id is not None:
+                category = rng.choice(('Effects', 'Status'))
+                yield self.callback(user_id, f'shop_category:{category}', message_id)
+                item = 'Trigger Word' if category == 'Effects' else rng.choice(('VIP', 'Title: Крипто-король'))
+                yield self.callback(user_id, f'buy_item:{category}:{item}', message_id)
+        elif kind == 'create_coin':
+            new_ticker = f'N{next(self._new_tickers)}'
+            price = rng.randint(1, 10)
+            command = self.message(user_id, f'/create_coin {new_ticker} {price}')
+            yield command
+            message_id = self._answer_to(command)
+            if message_id is not None:
+                yield self.callback(user_id, f'create_tier:{new_ticker}:{price * MONEY_SCALE}:{rng.choice(list(TIERS))}', message_id)
+
+    def scenarios(self, mix):
+        kinds, weights = zip(*mix.items())
+        while True:
+            yield self.scenario(self.rng.choices(kinds, weights)[0])
+
+
+def _percentiles(values):
+    values = sorted(values)
+    return [values[min(len(values) - 1, int(len(values) * p / 100))] for p in PERCENTILES]
+
+
+async def run(updates, users, coins, triggers, concurrency, throttling, seed_value, db_path):
+    # Imported here so DATABASE_PATH is set before anything connects
+    from main import build_dispatcher, startup, shutdown
+
+    # aiogram logs every handled update at INFO
+    logging.getLogger('aiogram.event').setLevel(logging.WARNING)
+    rng = random.Random(seed_value)
+    database.DATABASE_PATH = db_path
+    await database.init_db()
+    try:
+        await seed(users, coins, triggers, rng)
+        await startup()
+
+        session = FakeSession()
+        bot = Bot(token=TOKEN, session=session)
+        dp = build_dispatcher(throttling=throttling)
+        timings = defaultdict(list)
+        dp.message.middleware(HandlerTimer(timings))
+        dp.callback_query.middleware(HandlerTimer(timings))
+
+        traffic = Traffic(users, coins, session, rng)
+        scenarios = traffic.scenarios(MIX)
+        latencies = []
+        errors = Counter()
+        budget = [updates]
+
+        async def worker():
+            while budget[0] > 0:
+                for update in next(scenarios):
+                    if budget[0] <= 0:
+                        break
+                    budget[0] -= 1
+                    started = time.perf_counter()
+                    try:
+                        await dp.feed_raw_update(bot, update)
+                    except Exception as e:
+                        errors[type(e).__name__] += 1
+                    latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    finally:
+        await shutdown()
+
+    print(f'{len(latencies)} updates in {elapsed:.2f}s: {len(latencies) / elapsed:,.0f} updates/s '
+          f'({users} users, {coins} coins, concurrency {concurrency})')
+    print('update latency ms: ' + ', '.join(f'p{p}={v * 1000:.2f}' for p, v in zip(PERCENTILES, _percentiles(latencies))))
+    print(f'{"handler":<24}{"calls":>8}' + ''.join(f'{f"p{p} ms":>10}' for p in PERCENTILES))
+    for name, values in sorted(timings.items(), key=lambda item: -len(item[1])):
+        print(f'{name:<24}{len(values):>8}' + ''.join(f'{v * 1000:>10.2f}' for v in _percentiles(values)))
+    print('bot api calls: ' + ', '.join(f'{name}={count}' for name, count in session.calls.most_common()))
+    if QUERY_PROFILING:
+        print('top statements (QUERY_PROFILING):')
+        for sql, calls, rows, seconds, _ in query_profiler.top_queries(10):
+            print(f'{seconds * 1000:10.1f} ms {calls:8d} calls {rows:9d} rows  {sql[:100]}')
+    if errors:
+        print('errors: ' + ', '.join(f'{name}={count}' for name, count in errors.most_common()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Feed synthetic updates through the bot and report throughput')
+    parser.add_argument('--updates', type=int, default=10_000)
+    parser.add_argument('--users', type=int, default=1_000, help='seeded users')
+    parser.add_argument('--coins', type=int, default=100, help='seeded coins')
+    parser.add_argument('--triggers', type=int, default=100, help='seeded active trigger words')
+    parser.add_argument('--concurrency', type=int, default=20, help='updates in flight')
+    parser.add_argument('--throttle', action='store_true', help='keep the per-user rate limits on')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--db', help='database file to create (default: a temporary one)')
+    args = parser.parse_args()
+
+    workdir = None
+    db_path = args.db
+    if db_path is None:
+        workdir = tempfile.mkdtemp(prefix='loadtest_')
+        db_path = os.path.join(workdir, 'loadtest.db')
+    elif os.path.exists(db_path):
+        parser.error(f'{db_path} already exists; the load test needs a fresh database')
+    try:
+        asyncio.run(run(args.updates, args.users, args.coins, args.triggers, args.concurrency, args.throttle, args.seed, db_path))
+    finally:
+        if workdir is not None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,79 +1,97 @@
 import asyncio
 import json
-from fastapi import FastAPI, HTTPException
+import secrets
+import sqlite3
+import time
+from datetime import datetime
+import uvicorn
+from fastapi import Depends, FastAPI, HTTPException, Request, Response, WebSocket
+from fastapi.responses import JSONResponse
 from aiogram import Bot, Dispatcher, F
 from aiogram.types import Message, WebAppInfo, InlineKeyboardMarkup, InlineKeyboardButton
-from config import BOT_TOKEN, ADMIN_ID
-from database import get_balance, update_balance, create_coin, get_coin, get_coin_price, add_to_inventory, remove_from_inventory, add_transaction, update_coin_supply, update_coin_volume, update_royalties, get_user_tokens, get_top_users, get_top_creators, get_top_coins, get_address, get_user_by_username, get_global_var, set_global_var, get_user_balance, get_user_tokens, buy_token, sell_token, create_coin
+from config import BOT_TOKEN, ADMIN_ID, API_HOST, API_PORT, MAX_BATCH_ACTIONS, QUERY_PROFILING, QUERY_STATS_INTERVAL, SAMPLING_PROFILER
+from database import init_db, close_db, get_balance, update_balance, create_coin, get_daily_stats, get_daily_creators, prune_daily_traders, get_equity_leaderboard, get_user_by_username, get_user_snapshot, get_user_version, transaction, TradeError, get_candles
+from candles import INTERVALS
+from daily_stats import day_of, price_change
+from money import to_money, to_amount, to_rate, money_value, amount_value, format_money, format_amount
+from pricing import quote_batch
+from order_queue import submit_order, settle_fills, drain as drain_orders
+import treasury
+import transaction_log
+import duels
+import expiry
+import live_updates
+import metrics
+import query_profiler
+import sampling_profiler
+from archive import archive_transactions, get_transaction_history
 from middlewares.reaction_middleware import ReactionMiddleware
+from middlewares.throttling_middleware import ThrottlingMiddleware
+from middlewares.metrics_middleware import UpdateMetricsMiddleware, HandlerMetricsMiddleware
+from middlewares.query_profiler_middleware import QueryProfilerMiddleware
+from middlewares.profiler_middleware import ProfilerMiddleware
+from rate_limit import limit_api_actions
 from handlers.casino_games import router as casino_router
-from handlers.shop_effects import router as shop_router
+from handlers.shop_effects import router as shop_router, load_triggers
 from handlers.economy_admin import router as admin_router
 from handlers.market_logic import router as market_router
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
 import logging
 
 # Set logging
 logging.basicConfig(level=logging.INFO)
 
+TRADE_ERRORS = {
+    'not_found': "Токен не знайдено",
+    'invalid_amount': "Невірна сума",
+    'insufficient_balance': "Недостатньо коштів",
+    'insufficient_tokens': "Недостатньо токенів",
+}
+
+# The API is served from the bot process (see main()): user versions live in
+# memory, so a separate API process would never see the bot's writes
+app = FastAPI()
+app.add_middleware(metrics.HTTPMetricsMiddleware)
+if QUERY_PROFILING:
+    app.add_middleware(query_profiler.QueryScopeMiddleware)
+
+# Part of every ETag, so tags issued before a restart never match
+BOOT_ID = secrets.token_hex(4)
+
 # Helper functions for actions
 async def perform_buy(user_id, ticker, amount):
-    coin = await get_coin(ticker)
-    if not coin:
-        return "Токен не знайдено"
-    
-    price = await get_coin_price(ticker)
-    total_cost = price * Decimal(str(amount))
-    
-    bal = await get_balance(user_id)
-    if bal < float(total_cost):
-        return "Недостатньо коштів"
-    
-    # Update supply
-    new_supply = Decimal(str(coin[3])) + Decimal(str(amount))
-    await update_coin_supply(ticker, float(new_supply))
-    await update_coin_volume(ticker, float(total_cost))
-    await update_balance(user_id, -float(total_cost))
-    await add_to_inventory(user_id, ticker, amount)
-    await add_transaction(user_id, ticker, amount, float(price), "buy")
-    return f"Куплено {amount} {ticker}"
+    try:
+        trade = await submit_order(user_id, ticker, 'buy', to_amount(amount))
+    except ValueError:
+        return TRADE_ERRORS['invalid_amount']
+    except TradeError as e:
+        return TRADE_ERRORS[e.reason]
+    return f"Куплено {format_amount(trade['amount'])} {ticker} по {format_money(trade['price'], 4)}"
 
 async def perform_sell(user_id, ticker, amount):
-    coin = await get_coin(ticker)
-    if not coin:
-        return "Токен не знайдено"
-    
-    user_tokens = await get_user_tokens(user_id)
-    token_amount = next((t['amount'] for t in user_tokens if t['name'] == ticker), 0)
-    if token_amount < amount:
-        return "Недостатньо токенів"
-    
-    price = await get_coin_price(ticker)
-    total_earn = price * Decimal(str(amount))
-    
-    # Update supply
-    new_supply = Decimal(str(coin[3])) - Decimal(str(amount))
-    await update_coin_supply(ticker, float(new_supply))
-    await update_coin_volume(ticker, float(total_earn))
-    await update_balance(user_id, float(total_earn))
-    await remove_from_inventory(user_id, ticker, amount)
-    await add_transaction(user_id, ticker, -amount, float(price), "sell")
-    return f"Продано {amount} {ticker}"
+    try:
+        trade = await submit_order(user_id, ticker, 'sell', to_amount(amount))
+    except ValueError:
+        return TRADE_ERRORS['invalid_amount']
+    except TradeError as e:
+        return TRADE_ERRORS[e.reason]
+    return f"Продано {format_amount(trade['amount'])} {ticker} по {format_money(trade['price'], 4)}"
 
 async def perform_create_coin(user_id, name):
     # Simple create, assume tier Bronze
     tier = "Bronze"
-    initial_price = 1.0
+    initial_price = to_money(1)
     tier_info = TIERS[tier]
-    cost = tier_info["cost"]
+    cost = to_money(tier_info["cost"])
     
     bal = await get_balance(user_id)
     if bal < cost:
         return "Недостатньо коштів для створення токена"
     
     await update_balance(user_id, -cost)
-    await create_coin(name, user_id, initial_price, tier, tier_info["fee"], tier_info["bot_fee"])
+    await create_coin(name, user_id, initial_price, tier, to_rate(tier_info["fee"]), to_rate(tier_info["bot_fee"]))
     return f"Токен {name} створено!"
 
 TIERS = {
@@ -83,15 +101,93 @@ TIERS = {
 }
 
 @app.get("/api/user/{user_id}")
-async def get_user_data(user_id: int):
-    user = await get_user(user_id)
-    if not user:
+async def get_user_data(user_id: int, request: Request):
+    # The version is read before the snapshot, so a write racing the query
+    # can only make the next request miss, never serve stale data as fresh
+    etag = f'W/"{BOOT_ID}-{user_id}-{get_user_version(user_id)}"'
+    if etag in (tag.strip() for tag in request.headers.get("if-none-match", "").split(",")):
+        return Response(status_code=304, headers={"ETag": etag})
+    snapshot = await get_user_snapshot(user_id)
+    if snapshot is None:
         raise HTTPException(status_code=404, detail="User not found")
-    balance = await get_user_balance(user_id)
-    tokens = await get_user_tokens(user_id)
-    return {"balance": balance, "tokens": tokens}
+    balance, tokens = snapshot
+    return JSONResponse({"balance": money_value(balance),
+                         "tokens": [{"name": token["name"], "amount": amount_value(token["amount"])} for token in tokens]},
+                        headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+@app.websocket("/ws/{user_id}")
+async def user_updates(websocket: WebSocket, user_id: int):
+    """Push balance, holdings and held-ticker prices as they change."""
+    await live_updates.serve(websocket, user_id)
+
+@app.get("/metrics")
+async def get_metrics():
+    """Handler, update and endpoint metrics in the Prometheus text format."""
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+@app.get("/api/top")
+async def get_top(limit: int = 10):
+    rows = await get_equity_leaderboard(min(limit, 100))
+    return [{"id": id, "username": username, "balance": money_value(balance), "equity": money_value(equity)}
+            for id, username, balance, equity in rows]
+
+@app.post("/api/quote")
+async def get_quotes(data: dict):
+    """Quote a batch of orders: {"orders": [{"name": ..., "side": "buy", "amount": ...}, ...]}."""
+    orders = [(str(o.get("name", "")).upper(), o.get("side", "buy"), _parse_amount(o.get("amount"))) for o in data.get("orders", [])]
+    quotes = quote_batch(orders)
+    for quote in quotes:
+        quote["amount"] = amount_value(quote["amount"])
+        for key in ("price", "total", "new_price"):
+            if key in quote:
+                quote[key] = money_value(quote[key])
+    return {"quotes": quotes}
+
+def _parse_amount(value):
+    # Unparseable sizes are quoted as invalid_amount rather than failing the batch
+    try:
+        return to_amount(value)
+    except ValueError:
+        return 0
 
-@app.post("/api/action")
+@app.get("/api/candles/{ticker}")
+async def get_candle_history(ticker: str, interval: str = "1h", limit: int = 200):
+    if interval not in INTERVALS:
+        raise HTTPException(status_code=400, detail="Unknown interval")
+    rows = await get_candles(ticker.upper(), interval, min(limit, 1000))
+    return [{"t": bucket, "o": money_value(o), "h": money_value(h), "l": money_value(l), "c": money_value(c), "v": amount_value(v)}
+            for bucket, o, h, l, c, v in rows]
+
+@app.get("/api/report")
+async def get_report(day: str = None):
+    """Per-coin volume, trades, unique traders, price change and royalties for
+    one UTC day (YYYY-MM-DD, default today)."""
+    if day is None:
+        day = day_of(time.time())
+    else:
+        try:
+            datetime.strptime(day, "%Y-%m-%d")
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid day")
+    rows = await get_daily_stats(day)
+    return {
+        "day": day,
+        "volume": money_value(sum(row[1] for row in rows)),
+        "trades": sum(row[2] for row in rows),
+        "royalties": money_value(sum(row[6] for row in rows)),
+        "coins": [{"ticker": ticker, "volume": money_value(volume), "trades": trades, "traders": traders,
+                   "open": money_value(open_price), "close": money_value(close_price),
+                   "change": round(price_change(open_price, close_price), 2), "royalties": money_value(royalties)}
+                  for ticker, volume, trades, traders, open_price, close_price, royalties in rows],
+    }
+
+@app.get("/api/history/{ticker}")
+async def get_history(ticker: str, limit: int = 50):
+    rows = await get_transaction_history(ticker.upper(), min(limit, 500))
+    return [{"user_id": user_id, "type": type_, "amount": amount_value(amount), "price": money_value(price), "timestamp": timestamp}
+            for user_id, type_, amount, price, timestamp in rows]
+
+@app.post("/api/action", dependencies=[Depends(limit_api_actions)])
 async def process_action(data: dict):
     user_id = data.get("user_id")
     action = data.get("action")
@@ -109,20 +205,6 @@ async def process_action(data: dict):
             name = params.get("name")
             amount = params.get("amount")
             response = await perform_sell(user_id, name, amount)
-        elif action == "dice":
-            amount = params.get("amount")
-            target = params.get("target")
-            response = f"Запрошено {target} на дуель в кості на {amount}"
-        elif action == "dice_bot":
-            amount = params.get("amount")
-            response = f"Гра проти бота на {amount}"
-        elif action == "rob":
-            target = params.get("target")
-            response = f"Спроба пограбувати {target}"
-        elif action == "buy_item":
-            item = params.get("item")
-            # Simulate buy item
-            response = f"Куплено {item}"
         elif action == "give":
             amount = params.get("amount")
             target = params.get("target")
@@ -132,46 +214,186 @@ async def process_action(data: dict):
             else:
                 target_id = await get_user_by_username(target)
                 if target_id:
-                    await update_balance(target_id, amount)
+                    await update_balance(target_id, to_money(amount))
                     response = f"Дано {amount} користувачу {target}"
                 else:
                     response = "Користувач не знайдений"
         else:
-            response = "Невідома дія"
+            response = simulated_action_reply(action, params) or "Невідома дія"
     except Exception as e:
         response = f"Помилка: {str(e)}"
     
     return {"response": response}
 
+def simulated_action_reply(action, params):
+    # Games and shop purchases are played in the chat; the API only acknowledges them
+    if action == "dice":
+        amount = params.get("amount")
+        target = params.get("target")
+        return f"Запрошено {target} на дуель в кості на {amount}"
+    if action == "dice_bot":
+        amount = params.get("amount")
+        return f"Гра проти бота на {amount}"
+    if action == "rob":
+        target = params.get("target")
+        return f"Спроба пограбувати {target}"
+    if action == "buy_item":
+        item = params.get("item")
+        # Simulate buy item
+        return f"Куплено {item}"
+    return None
+
+class ActionRejected(Exception):
+    """A batched action was refused; the message is its reply."""
+
+async def perform_batch_action(tx, user_id, action, params, fills):
+    """Run one action of a batch inside ``tx`` and return its reply; trade
+    fills are appended to ``fills`` for settling after the commit."""
+    if action in ("buy", "sell"):
+        name = params.get("name")
+        try:
+            amount = to_amount(params.get("amount"))
+        except ValueError:
+            raise ActionRejected(TRADE_ERRORS['invalid_amount'])
+        try:
+            trade = await tx.trade(user_id, name, action, amount)
+        except TradeError as e:
+            raise ActionRejected(TRADE_ERRORS[e.reason])
+        fills.append(trade)
+        verb = "Куплено" if action == "buy" else "Продано"
+        return f"{verb} {format_amount(trade['amount'])} {name} по {format_money(trade['price'], 4)}"
+    if action == "create_coin":
+        name = params.get("name")
+        tier = "Bronze"
+        tier_info = TIERS[tier]
+        if not await tx.charge(user_id, to_money(tier_info["cost"])):
+            raise ActionRejected("Недостатньо коштів для створення токена")
+        try:
+            await tx.create_coin(name, user_id, to_money(1), tier, to_rate(tier_info["fee"]), to_rate(tier_info["bot_fee"]))
+        except sqlite3.IntegrityError:
+            raise ActionRejected("Токен вже існує")
+        return f"Токен {name} створено!"
+    if action == "give":
+        if user_id != ADMIN_ID:
+            raise ActionRejected("Немає дозволу")
+        target = params.get("target")
+        target_id = await tx.get_user_by_username(target)
+        if not target_id:
+            raise ActionRejected("Користувач не знайдений")
+        try:
+            amount = to_money(params.get("amount"))
+        except ValueError:
+            raise ActionRejected(TRADE_ERRORS['invalid_amount'])
+        await tx.add_balance(target_id, amount)
+        return f"Дано {format_money(amount)} користувачу {target}"
+    response = simulated_action_reply(action, params)
+    if response is None:
+        raise ActionRejected("Невідома дія")
+    return response
+
+@app.post("/api/action/batch", dependencies=[Depends(limit_api_actions)])
+async def process_action_batch(data: dict):
+    """Run {"user_id": ..., "atomic": false, "actions": [{"action": ..., "params": {...}}, ...]}
+    in order, in one database transaction, replying {"committed": bool, "results": [{"ok", "response"}, ...]}.
+
+    Normally a rejected action is rolled back on its own and the rest still
+    run. With "atomic": true the first rejection rolls back the whole batch
+    and the actions after it are not attempted.
+    """
+    user_id = data.get("user_id")
+    actions = data.get("actions", [])
+    atomic = bool(data.get("atomic", False))
+    if len(actions) > MAX_BATCH_ACTIONS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_ACTIONS} actions per batch")
+    
+    results = []
+    fills = []
+    try:
+        async with transaction() as tx:
+            for item in actions:
+                mark = len(fills)
+                try:
+                    async with tx.savepoint():
+                        response = await perform_batch_action(tx, user_id, item.get("action"), item.get("params", {}), fills)
+                except Exception as e:
+                    del fills[mark:]
+                    message = str(e) if isinstance(e, ActionRejected) else f"Помилка: {str(e)}"
+                    results.append({"ok": False, "response": message})
+                    if atomic:
+                        raise ActionRejected(message)
+                    continue
+                results.append({"ok": True, "response": response})
+    except ActionRejected:
+        results.extend({"ok": False, "response": "Скасовано"} for _ in actions[len(results):])
+        return {"committed": False, "results": results}
+    
+    await settle_fills(fills)
+    return {"committed": True, "results": results}
+
 async def morning_report(bot: Bot):
-    # Send to a channel or admin, for now to admin
-    top_coins = await get_top_coins(3)
-    top_creators = await get_top_creators(3)
-    bot_balance = await get_global_var('bot_balance')
+    # Send to a channel or admin, for now to admin; covers the previous UTC day
+    day = day_of(time.time() - 86400)
+    coins = await get_daily_stats(day)
+    top_creators = await get_daily_creators(day, 3)
+    bot_balance = treasury.get_balance()
     
-    text = "🌅 Morning Market Report:\n\n"
-    text += "Top Coins by Volume:\n"
-    for ticker, volume in top_coins:
-        text += f"${ticker}: {volume:.2f}\n"
+    text = f"🌅 Morning Market Report ({day} UTC):\n\n"
+    text += f"Volume: {format_money(sum(row[1] for row in coins))} in {sum(row[2] for row in coins)} trades\n"
+    text += "\nTop Coins by Volume:\n"
+    for ticker, volume, trades, traders, open_price, close_price, royalties in coins[:3]:
+        text += f"${ticker}: {format_money(volume)} ({trades} trades, {traders} traders, {price_change(open_price, close_price):+.1f}%)\n"
+    
+    movers = sorted(coins, key=lambda row: price_change(row[4], row[5]), reverse=True)
+    text += "\nTop Movers:\n"
+    for ticker, volume, trades, traders, open_price, close_price, royalties in movers[:3]:
+        text += f"${ticker}: {price_change(open_price, close_price):+.1f}% ({format_money(open_price)} → {format_money(close_price)})\n"
     
     text += "\nTop Creators by Royalties:\n"
     for id, username, royalties in top_creators:
-        text += f"@{username}: {royalties:.2f}\n"
+        text += f"@{username}: {format_money(royalties)}\n"
     
-    text += f"\nBot Treasury: {bot_balance} coins"
+    text += f"\nBot Treasury: {format_money(bot_balance)} coins"
     
     await bot.send_message(chat_id=ADMIN_ID, text=text)
 
-async def main():
-    print("Initializing bot...")
-    bot = Bot(token=BOT_TOKEN)
-    dp = Dispatcher()
-    
-    # Init db
+class EmbeddedServer(uvicorn.Server):
+    # Polling owns SIGINT/SIGTERM; the server is stopped when polling returns
+    def install_signal_handlers(self):
+        pass
+
+async def startup():
+    """Open the database and load the in-memory state the handlers rely on."""
     await init_db()
-    print("Database initialized.")
+    await treasury.load()
+    transaction_log.start()
+    await duels.load()
+    await load_triggers()
+
+async def shutdown():
+    """Finish queued trades and buffered writes, then close the database."""
+    sampling_profiler.stop()
+    await drain_orders()
+    await transaction_log.stop()
+    await treasury.flush()
+    await close_db()
+
+def build_dispatcher(throttling=True):
+    """The bot's Dispatcher with its middlewares and routers (also driven by loadtest.py).
+    The routers are module-level, so this can be called once per process."""
+    dp = Dispatcher()
     
-    # Add middleware
+    # Add middleware; metrics wrap everything, then throttling runs before filters and any DB access
+    dp.update.outer_middleware(UpdateMetricsMiddleware())
+    if SAMPLING_PROFILER:
+        dp.update.outer_middleware(ProfilerMiddleware())
+    if throttling:
+        dp.message.outer_middleware(ThrottlingMiddleware())
+        dp.callback_query.outer_middleware(ThrottlingMiddleware())
+    dp.message.middleware(HandlerMetricsMiddleware())
+    dp.callback_query.middleware(HandlerMetricsMiddleware())
+    if QUERY_PROFILING:
+        dp.message.middleware(QueryProfilerMiddleware())
+        dp.callback_query.middleware(QueryProfilerMiddleware())
     dp.message.middleware(ReactionMiddleware())
     
     # Include routers
@@ -216,17 +438,42 @@ async def main():
         except json.JSONDecodeError:
             await message.reply("Помилка обробки даних")
     
+    return dp
+
+async def main():
+    print("Initializing bot...")
+    bot = Bot(token=BOT_TOKEN)
+    
+    # Init db
+    await startup()
+    print("Database initialized.")
+    
+    dp = build_dispatcher()
+    
     # Scheduler
     scheduler = AsyncIOScheduler()
     scheduler.add_job(morning_report, CronTrigger(hour=9), args=[bot])
+    scheduler.add_job(archive_transactions, CronTrigger(hour=4))
+    scheduler.add_job(prune_daily_traders, CronTrigger(hour=4))
+    scheduler.add_job(expiry.sweep, IntervalTrigger(minutes=5))
+    if QUERY_PROFILING:
+        scheduler.add_job(query_profiler.log_top_queries, IntervalTrigger(minutes=QUERY_STATS_INTERVAL))
     scheduler.start()
     
+    # Mini-app API
+    api = EmbeddedServer(uvicorn.Config(app, host=API_HOST, port=API_PORT, lifespan="off"))
+    api_task = asyncio.create_task(api.serve())
+    
     print("Bot started! Press Ctrl+C to stop.")
     # Start polling
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        api.should_exit = True
+        await api_task
+        scheduler.shutdown(wait=False)
+        await shutdown()
 
 if __name__ == '__main__':
-    import uvicorn
-    # Run bot in asyncio
-    asyncio.run(main())
-    # For API, run separately: uvicorn main:app --host 0.0.0.0 --port 8001
\ No newline at end of file
+    # Runs the bot and the mini-app API together
+    asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,151 @@
+import time
+from bisect import bisect_left
+
+# In-process metrics for the bot and the mini-app API, served in the Prometheus
+# text format from /metrics. Recording is a dict lookup, a bisect and a few
+# integer adds (no locks: everything runs on the event loop); buckets are made
+# cumulative only when the page is rendered.
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+
+_metrics = []
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _label_text(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._series = {}
+        _metrics.append(self)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+        for key, value in sorted(self._series.items()):
+            lines.extend(self._render_series(key, value))
+        return lines
+
+    def _render_series(self, key, value):
+        return [f'{self.name}{_label_text(self.labels, key)} {value}']
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, key=(), amount=1):
+        self._series[key] = self._series.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    type = 'gauge'
+
+    def inc(self, key=()):
+        self._series[key] = self._series.get(key, 0) + 1
+
+    def dec(self, key=()):
+        self._series[key] -= 1
+
+
+class Histogram(_Metric):
+    """Keeps, per label set, one count per bucket (plus +Inf) and the sum."""
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+
+    def observe(self, key, value):
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [0] * (len(self.buckets) + 2)
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def _render_series(self, key, series):
+        lines = []
+        cumulative = 0
+        for bound, count in zip((*self.buckets, '+Inf'), series):
+            cumulative += count
+            le = f'le="{bound}"'
+            lines.append(f'{self.name}_bucket{_label_text(self.labels, key, le)} {cumulative}')
+        labels = _label_text(self.labels, key)
+        lines.append(f'{self.name}_sum{labels} {series[-1]}')
+        lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+def render():
+    """The current values of every metric, as a Prometheus text page."""
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+# Bot updates (middlewares/metrics_middleware.py)
+updates_in_flight = Gauge('bot_updates_in_flight', 'Updates being processed', ('event_type',))
+update_duration = Histogram('bot_update_duration_seconds', 'Time from receiving an update to finishing it', ('event_type',))
+update_errors = Counter('bot_update_errors_total', 'Updates that raised', ('event_type', 'error'))
+handler_duration = Histogram('bot_handler_duration_seconds', 'Time spent in each handler, including inner middlewares', ('handler',))
+handler_errors = Counter('bot_handler_errors_total', 'Handler calls that raised', ('handler', 'error'))
+handler_queries = Histogram('bot_handler_queries', 'SQL statements per handler call (QUERY_PROFILING only)', ('handler',),
+                            QUERY_COUNT_BUCKETS)
+
+# Mini-app API (HTTPMetricsMiddleware)
+http_in_flight = Gauge('http_requests_in_flight', 'HTTP requests being served')
+http_duration = Histogram('http_request_duration_seconds', 'HTTP request latency by route template', ('method', 'route'))
+http_requests = Counter('http_requests_total', 'HTTP responses by status code', ('method', 'route', 'status'))
+http_errors = Counter('http_request_errors_total', 'HTTP requests that raised', ('method', 'route', 'error'))
+
+
+class HTTPMetricsMiddleware:
+    """ASGI middleware recording latency, status codes, errors and in-flight
+    requests per route template (``/api/user/{user_id}``, never the raw path,
+    so the number of series stays bounded)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        http_in_flight.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        except Exception as e:
+            http_errors.inc((scope['method'], _route(scope), type(e).__name__))
+            raise
+        finally:
+            route = _route(scope)
+            http_duration.observe((scope['method'], route), time.perf_counter() - started)
+            http_requests.inc((scope['method'], route, status))
+            http_in_flight.dec()
+
+
+def _route(scope):
+    # The router stores the matched route in the scope
+    route = scope.get('route')
+    return getattr(route, 'path', None) or 'unmatched'
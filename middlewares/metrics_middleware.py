@@ -0,0 +1,35 @@
+import time
+from aiogram import BaseMiddleware
+from metrics import updates_in_flight, update_duration, update_errors, handler_duration, handler_errors
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """Outer middleware on dp.update: in-flight updates, end-to-end latency and
+    errors per event type, including updates that are throttled or unhandled."""
+
+    async def __call__(self, handler, event, data):
+        key = (event.event_type,)
+        updates_in_flight.inc(key)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception as e:
+            update_errors.inc((event.event_type, type(e).__name__))
+            raise
+        finally:
+            update_duration.observe(key, time.perf_counter() - started)
+            updates_in_flight.dec(key)
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Inner middleware: latency and errors per handler. Inner middlewares only
+    run once a handler has matched, so its name is known here."""
+
+    async def __call__(self, handler, event, data):
+        key = (data['handler'].callback.__name__,)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception as e:
+            handler_errors.inc((key[0], type(e).__name__))
+            raise
+        finally:
+            handler_duration.observe(key, time.perf_counter() - started)
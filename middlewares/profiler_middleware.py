@@ -0,0 +1,22 @@
+from aiogram import BaseMiddleware
+import sampling_profiler
+
+class ProfilerMiddleware(BaseMiddleware):
+    """Outer middleware on dp.update (SAMPLING_PROFILER only): brackets each
+    update for the sampling profiler, which keeps a profile of slow ones."""
+
+    async def __call__(self, handler, event, data):
+        token = sampling_profiler.begin()
+        try:
+            return await handler(event, data)
+        finally:
+            sampling_profiler.finish(token, _describe(event))
+
+def _describe(update):
+    # e.g. "message /buy" or "callback_query accept_duel"
+    event = update.event
+    if update.event_type == 'message' and event.text:
+        return f"message {event.text.split(maxsplit=1)[0] if event.text.startswith('/') else 'text'}"
+    if update.event_type == 'callback_query' and event.data:
+        return f"callback_query {event.data.split(':')[0]}"
+    return update.event_type
@@ -0,0 +1,15 @@
+from aiogram import BaseMiddleware
+from metrics import handler_queries
+from query_profiler import profile_scope
+
+class QueryProfilerMiddleware(BaseMiddleware):
+    """Inner middleware (QUERY_PROFILING only): runs each handler in its own
+    query scope and records how many SQL statements it cost."""
+
+    async def __call__(self, handler, event, data):
+        name = data['handler'].callback.__name__
+        with profile_scope(name) as query_scope:
+            try:
+                return await handler(event, data)
+            finally:
+                handler_queries.observe((name,), query_scope.queries)
@@ -1,14 +1,14 @@
 from aiogram import BaseMiddleware
 from aiogram.types import Message
-from database import get_user, create_user
+from database import get_user_profile, create_user
 
 class ReactionMiddleware(BaseMiddleware):
     async def __call__(self, handler, event: Message, data):
-        # Ensure user exists
+        # Ensure user exists (profiles are cached, so known users cost no DB read)
         if event.from_user:
             user_id = event.from_user.id
             username = event.from_user.username
-            if not await get_user(user_id):
+            if not await get_user_profile(user_id):
                 await create_user(user_id, username)
         
         # Call the handler first
@@ -16,8 +16,8 @@ class ReactionMiddleware(BaseMiddleware):
         
         # After handling, check if user is VIP
         if event.from_user:
-            user = await get_user(event.from_user.id)
-            if user and user[3] == 1:  # vip_status
+            user = await get_user_profile(event.from_user.id)
+            if user and user[2] == 1:  # vip_status
                 # Set reaction
                 try:
                     await event.bot.set_message_reaction(
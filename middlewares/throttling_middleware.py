@@ -0,0 +1,31 @@
+import logging
+from aiogram import BaseMiddleware
+from aiogram.types import Message, CallbackQuery
+from rate_limit import limiters, command_class, callback_class
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Drops commands and button presses from users who have used up their
+    token bucket (see RATE_LIMITS). Registered as an outer middleware, so it
+    runs before filters, ReactionMiddleware and any database access."""
+
+    async def __call__(self, handler, event, data):
+        user = event.from_user
+        if user is None:
+            return await handler(event, data)
+        
+        if isinstance(event, CallbackQuery):
+            name = callback_class(event.data)
+        elif isinstance(event, Message) and event.text and event.text.startswith('/'):
+            name = command_class(event.text)
+        else:
+            # Plain chat messages only feed the trigger matcher, which is cheap
+            return await handler(event, data)
+        
+        if limiters[name].allow(user.id):
+            return await handler(event, data)
+        
+        logging.debug("Throttled %s from %s", name, user.id)
+        if isinstance(event, CallbackQuery):
+            # Stop the button's loading spinner
+            await event.answer("Забагато запитів, зачекайте")
+        return None
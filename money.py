@@ -0,0 +1,62 @@
+from decimal import Decimal, InvalidOperation, ROUND_HALF_EVEN
+
+# Money, token amounts and fee rates are plain ints in minor units, in SQLite and
+# in Python alike: 1 coin = MONEY_SCALE, 1 token = AMOUNT_SCALE, a rate of 1 =
+# RATE_SCALE (so fees are parts per million). Prices are MONEY units per whole token.
+MONEY_SCALE = 1_000_000
+AMOUNT_SCALE = 1_000_000
+RATE_SCALE = 1_000_000
+# SQLite INTEGER is a signed 64-bit value
+MAX_UNITS = 2**63 - 1
+
+
+def _to_units(value, scale):
+    try:
+        units = Decimal(str(value)) * scale
+    except InvalidOperation:
+        raise ValueError(f'Not a number: {value!r}') from None
+    if not units.is_finite():
+        raise ValueError(f'Not a finite number: {value!r}')
+    units = int(units.to_integral_value(ROUND_HALF_EVEN))
+    if not -MAX_UNITS <= units <= MAX_UNITS:
+        raise ValueError(f'Out of range: {value!r}')
+    return units
+
+
+# Parsing user input (str, int or float), rounded half-even to the nearest unit;
+# raises ValueError on anything that is not a finite number or doesn't fit in
+# a SQLite INTEGER once scaled
+def to_money(value):
+    return _to_units(value, MONEY_SCALE)
+
+
+def to_amount(value):
+    return _to_units(value, AMOUNT_SCALE)
+
+
+def to_rate(value):
+    return _to_units(value, RATE_SCALE)
+
+
+def units_sql(column, scale):
+    """SQL expression converting a legacy REAL column to minor units (for migrations)."""
+    return f'CAST(ROUND({column} * {scale}) AS INTEGER)'
+
+
+# JSON responses keep their float coins and tokens
+def money_value(units):
+    return units / MONEY_SCALE
+
+
+def amount_value(units):
+    return units / AMOUNT_SCALE
+
+
+# Display
+def format_money(units, places=2):
+    return f'{Decimal(units) / MONEY_SCALE:.{places}f}'
+
+
+def format_amount(units):
+    text = f'{Decimal(units) / AMOUNT_SCALE:f}'
+    return text.rstrip('0').rstrip('.') if '.' in text else text
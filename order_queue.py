@@ -0,0 +1,80 @@
+import asyncio
+import contextvars
+from database import execute_trades
+import treasury
+import transaction_log
+import live_updates
+import query_profiler
+
+# Orders for one ticker are applied in arrival order by a single worker, which
+# takes everything queued (up to MAX_BATCH) and commits it as one transaction.
+# Workers run in an empty context; each order carries its submitter's query
+# scope, and a batch's statements are charged evenly to the orders in it
+MAX_BATCH = 100
+WORKER_IDLE_TIMEOUT = 30
+
+_queues = {}
+_workers = {}
+
+
+async def submit_order(user_id, ticker, side, amount):
+    """Queue a buy or sell behind earlier orders on the same ticker and wait
+    for its fill; raises TradeError if it is rejected."""
+    if side not in ('buy', 'sell'):
+        raise ValueError(f'Unknown trade side: {side}')
+    future = asyncio.get_running_loop().create_future()
+    queue = _queues.get(ticker)
+    if queue is None:
+        queue = _queues[ticker] = asyncio.Queue()
+        _workers[ticker] = asyncio.create_task(_run_worker(ticker, queue), context=contextvars.Context())
+    queue.put_nowait((user_id, side, amount, future, query_profiler.current_scope()))
+    return await future
+
+
+async def _run_worker(ticker, queue):
+    while True:
+        try:
+            first = await asyncio.wait_for(queue.get(), WORKER_IDLE_TIMEOUT)
+        except asyncio.TimeoutError:
+            if queue.empty():
+                # No await between the check and the removal, so no order can slip in
+                del _queues[ticker]
+                del _workers[ticker]
+                return
+            continue
+        batch = [first]
+        while len(batch) < MAX_BATCH and not queue.empty():
+            batch.append(queue.get_nowait())
+        try:
+            with query_profiler.charge_to([query_scope for *_, query_scope in batch]):
+                results = await execute_trades(ticker, [(user_id, side, amount) for user_id, side, amount, _, _ in batch])
+        except Exception as e:
+            results = [e] * len(batch)
+        await settle_fills([result for result in results if not isinstance(result, Exception)])
+        for (_, _, _, future, _), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+        for _ in batch:
+            queue.task_done()
+
+
+async def settle_fills(fills):
+    """Book what follows committed fills: bot fees into the treasury, audit
+    rows into the transaction log and one price tick per ticker."""
+    prices = {}
+    for fill in fills:
+        treasury.add(fill['bot_fee'])
+        await transaction_log.add_transaction(fill['user_id'], fill['ticker'], fill['side'], fill['amount'],
+                                              fill['price'], fill['timestamp'])
+        prices[fill['ticker']] = fill['new_price']
+    for ticker, price in prices.items():
+        live_updates.publish_price(ticker, price)
+
+
+async def drain():
+    """Wait until every queued order has been applied (used on shutdown)."""
+    await asyncio.gather(*(queue.join() for queue in list(_queues.values())))
@@ -0,0 +1,88 @@
+from money import AMOUNT_SCALE
+
+# Bonding curve: price(s) = initial_price * (1 + s / CURVE_SCALE), so the price
+# doubles every 1000 tokens of supply. Prices are money units per whole token and
+# supply and amounts are token units (see money.py), so everything below is
+# exact integer arithmetic.
+CURVE_SCALE = 1000 * AMOUNT_SCALE
+
+# ticker -> (initial_price, current_supply), loaded once at startup and kept
+# current by coin creation and the trade engine, so quotes never read the DB
+_curves = {}
+
+
+def spot_price(initial_price, supply):
+    return initial_price * (CURVE_SCALE + supply) // CURVE_SCALE
+
+
+def buy_cost(initial_price, supply, amount):
+    """Cost of buying ``amount`` tokens: the curve integrated over
+    [supply, supply + amount], rounded up."""
+    numerator = initial_price * amount * (2 * CURVE_SCALE + 2 * supply + amount)
+    return -(-numerator // (2 * CURVE_SCALE * AMOUNT_SCALE))
+
+
+def sell_proceeds(initial_price, supply, amount):
+    """Proceeds of selling ``amount`` tokens: the curve integrated over
+    [supply - amount, supply], rounded down."""
+    numerator = initial_price * amount * (2 * CURVE_SCALE + 2 * supply - amount)
+    return numerator // (2 * CURVE_SCALE * AMOUNT_SCALE)
+
+
+def order_total(initial_price, supply, side, amount):
+    # Rounding always favours the pool, so a buy and its matching sell can't mint money
+    if side == 'buy':
+        return buy_cost(initial_price, supply, amount)
+    return sell_proceeds(initial_price, supply, amount)
+
+
+def fill_price(total, amount):
+    """Average execution price of a fill, in money units per token."""
+    return total * AMOUNT_SCALE // amount
+
+
+# Curve cache
+def set_curve(ticker, initial_price, supply):
+    _curves[ticker] = (initial_price, supply)
+
+
+def load_curves(rows):
+    _curves.clear()
+    for ticker, initial_price, supply in rows:
+        set_curve(ticker, initial_price, supply)
+
+
+def get_curve(ticker):
+    return _curves.get(ticker)
+
+
+def quote_batch(orders):
+    """Price many (ticker, side, amount) orders from the curve cache; amounts
+    are token units.
+
+    Each order is quoted independently against the current supply. Returns
+    one dict per order; unknown tickers and bad sizes come back with an
+    ``error`` key instead of a price.
+    """
+    curves = _curves
+    quotes = []
+    for ticker, side, amount in orders:
+        curve = curves.get(ticker)
+        if curve is None:
+            quotes.append({'ticker': ticker, 'side': side, 'amount': amount, 'error': 'not_found'})
+            continue
+        initial_price, supply = curve
+        if amount <= 0 or side not in ('buy', 'sell') or (side == 'sell' and amount > supply):
+            quotes.append({'ticker': ticker, 'side': side, 'amount': amount, 'error': 'invalid_amount'})
+            continue
+        total = order_total(initial_price, supply, side, amount)
+        new_supply = supply + amount if side == 'buy' else supply - amount
+        quotes.append({
+            'ticker': ticker,
+            'side': side,
+            'amount': amount,
+            'price': fill_price(total, amount),
+            'total': total,
+            'new_price': spot_price(initial_price, new_supply),
+        })
+    return quotes
@@ -0,0 +1,245 @@
+import contextvars
+import logging
+import re
+import time
+from contextlib import contextmanager
+from config import SLOW_QUERY_MS, QUERY_STATS_TOP_N
+
+# Opt-in SQL profiling (QUERY_PROFILING in config.py). Pooled connections are
+# wrapped in ProfiledConnection, which times every statement, including the
+# fetches that step through its rows, and charges it to:
+#   - the scope of the current update or API request, held in a contextvar, so
+#     each one can report how many statements and rows it cost;
+#   - an aggregate per normalized statement (literals and IN lists folded), for
+#     the top-N report;
+#   - the slow query log, once a statement passes SLOW_QUERY_MS, along with its
+#     EXPLAIN QUERY PLAN (taken once per normalized statement).
+# Background tasks (order workers, log and treasury flushes, expiry timers)
+# start in an empty context, so they never inherit the scope of whichever
+# update happened to start them. An order worker charges each batch's trade
+# statements to the scopes of the updates that submitted its orders, split
+# evenly (charge_to). A scope stops counting when its update ends, so later
+# work is only aggregated, never misattributed.
+EXPLAINABLE = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE', 'WITH')
+NORMALIZED_CACHE_SIZE = 1000
+
+_current = contextvars.ContextVar('query_scope', default=None)
+_stats = {}  # normalized sql -> [calls, rows, seconds, max_seconds]
+_plans = {}  # normalized sql -> EXPLAIN QUERY PLAN text
+_normalized = {}
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_IN_LISTS = re.compile(r'\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)', re.IGNORECASE)
+_SPACE = re.compile(r'\s+')
+
+
+def normalize(sql):
+    """Statement text with literals as ``?`` and ``IN (?, ?, ...)`` folded, so
+    calls that differ only in values aggregate together."""
+    normalized = _normalized.get(sql)
+    if normalized is None:
+        if len(_normalized) >= NORMALIZED_CACHE_SIZE:
+            _normalized.clear()
+        normalized = _SPACE.sub(' ', _LITERALS.sub('?', sql)).strip()
+        normalized = _normalized[sql] = _IN_LISTS.sub('IN (?, ...)', normalized)
+    return normalized
+
+
+class QueryScope:
+    __slots__ = ('label', 'queries', 'rows', 'seconds', 'open')
+
+    def __init__(self, label):
+        self.label = label
+        self.queries = 0
+        self.rows = 0
+        self.seconds = 0.0
+        self.open = True
+
+    def charge(self, queries, rows, seconds):
+        if self.open:
+            self.queries += queries
+            self.rows += rows
+            self.seconds += seconds
+
+
+class SharedScope:
+    """Charges statements run for a batch of ``size`` requests evenly to the
+    scopes of those that had one."""
+    __slots__ = ('scopes', 'share', 'label')
+
+    def __init__(self, scopes, size):
+        self.scopes = scopes
+        self.share = 1 / size
+        self.label = ', '.join(dict.fromkeys(query_scope.label for query_scope in scopes))
+
+    def charge(self, queries, rows, seconds):
+        share = self.share
+        for query_scope in self.scopes:
+            query_scope.charge(queries * share, rows * share, seconds * share)
+
+
+def current_scope():
+    """The scope statements run here are charged to, if any; hand it to
+    charge_to() when the work is done by another task."""
+    return _current.get()
+
+
+@contextmanager
+def charge_to(scopes):
+    """Charge the statements run inside the block evenly to ``scopes``, one
+    per request in a batch (None for requests with no scope)."""
+    profiled = [query_scope for query_scope in scopes if query_scope is not None]
+    token = _current.set(SharedScope(profiled, len(scopes)) if profiled else None)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def profile_scope(label):
+    """Attribute the statements run inside the block to ``label``; the
+    caller may rename the scope before the block ends."""
+    query_scope = QueryScope(label)
+    token = _current.set(query_scope)
+    try:
+        yield query_scope
+    finally:
+        query_scope.open = False
+        _current.reset(token)
+        logging.debug("%s: %g queries, %g rows, %.1f ms", query_scope.label, query_scope.queries,
+                      query_scope.rows, query_scope.seconds * 1000)
+
+
+class _Statement:
+    """One execution: its time and rows grow as the cursor is fetched."""
+
+    def __init__(self, db, sql, parameters):
+        self.db = db
+        self.sql = sql
+        self.parameters = parameters
+        self.normalized = normalize(sql)
+        self.seconds = 0.0
+        self.scope = _current.get()
+        self.logged = False
+        entry = _stats.get(self.normalized)
+        if entry is None:
+            entry = _stats[self.normalized] = [0, 0, 0.0, 0.0]
+        entry[0] += 1
+        self.entry = entry
+        if self.scope is not None:
+            self.scope.charge(1, 0, 0.0)
+
+    async def add(self, seconds, rows):
+        self.seconds += seconds
+        entry = self.entry
+        entry[1] += rows
+        entry[2] += seconds
+        entry[3] = max(entry[3], self.seconds)
+        if self.scope is not None:
+            self.scope.charge(0, rows, seconds)
+        if not self.logged and self.seconds * 1000 >= SLOW_QUERY_MS:
+            self.logged = True
+            await self._log_slow()
+
+    async def _log_slow(self):
+        plan = _plans.get(self.normalized)
+        if plan is None and self.normalized.lstrip('( ').upper().startswith(EXPLAINABLE):
+            try:
+                cursor = await self.db.execute(f'EXPLAIN QUERY PLAN {self.sql}', self.parameters or ())
+                plan = _plans[self.normalized] = '; '.join(row[-1] for row in await cursor.fetchall())
+            except Exception as e:
+                plan = f'unavailable ({e})'
+        label = self.scope.label if self.scope is not None else 'background'
+        logging.warning("Slow query (%.1f ms, %s): %s params=%.200r plan: %s", self.seconds * 1000, label,
+                        self.normalized, self.parameters, plan or '-')
+
+
+class ProfiledCursor:
+    def __init__(self, cursor, statement):
+        self._cursor = cursor
+        self._statement = statement
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    async def fetchone(self):
+        started = time.perf_counter()
+        row = await self._cursor.fetchone()
+        await self._statement.add(time.perf_counter() - started, row is not None)
+        return row
+
+    async def fetchmany(self, size=None):
+        started = time.perf_counter()
+        rows = await (self._cursor.fetchmany() if size is None else self._cursor.fetchmany(size))
+        await self._statement.add(time.perf_counter() - started, len(rows))
+        return rows
+
+    async def fetchall(self):
+        started = time.perf_counter()
+        rows = await self._cursor.fetchall()
+        await self._statement.add(time.perf_counter() - started, len(rows))
+        return rows
+
+
+class ProfiledConnection:
+    """Proxy for an aiosqlite connection that profiles execute and executemany."""
+
+    def __init__(self, db):
+        self._db = db
+
+    def __getattr__(self, name):
+        return getattr(self._db, name)
+
+    async def execute(self, sql, parameters=None):
+        statement = _Statement(self._db, sql, parameters)
+        started = time.perf_counter()
+        cursor = await self._db.execute(sql, parameters)
+        # Writes report their row count; SELECT rows are counted as they are fetched
+        await statement.add(time.perf_counter() - started, max(cursor.rowcount, 0))
+        return ProfiledCursor(cursor, statement)
+
+    async def executemany(self, sql, parameters):
+        # The first row stands in for the batch when the statement is explained
+        if not isinstance(parameters, (list, tuple)):
+            parameters = list(parameters)
+        statement = _Statement(self._db, sql, parameters[0] if parameters else None)
+        started = time.perf_counter()
+        cursor = await self._db.executemany(sql, parameters)
+        await statement.add(time.perf_counter() - started, max(cursor.rowcount, 0))
+        return ProfiledCursor(cursor, statement)
+
+
+def top_queries(limit=QUERY_STATS_TOP_N):
+    """The statements with the most total time, as (sql, calls, rows, seconds, max_seconds)."""
+    ranked = sorted(_stats.items(), key=lambda item: item[1][2], reverse=True)
+    return [(sql, *entry) for sql, entry in ranked[:limit]]
+
+
+def log_top_queries():
+    lines = [f'{seconds * 1000:10.1f} ms {calls:8d} calls {rows:9d} rows {max_seconds * 1000:8.1f} ms max  {sql}'
+             for sql, calls, rows, seconds, max_seconds in top_queries()]
+    if lines:
+        logging.info("Top SQL statements by total time:\n%s", '\n'.join(lines))
+
+
+def reset():
+    _stats.clear()
+
+
+class QueryScopeMiddleware:
+    """ASGI middleware giving each API request its own scope, named after the
+    method and route template once routing has happened."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        with profile_scope(scope['path']) as query_scope:
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                route = getattr(scope.get('route'), 'path', None) or scope['path']
+                query_scope.label = f"{scope['method']} {route}"
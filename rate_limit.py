@@ -0,0 +1,99 @@
+import math
+import time
+from collections import OrderedDict
+from fastapi import HTTPException, Request
+from config import RATE_LIMITS, RATE_LIMIT_MAX_KEYS, MAX_BATCH_ACTIONS
+
+# Commands and buttons map to a class in RATE_LIMITS; anything unlisted is 'command'
+COMMAND_CLASSES = {
+    '/dice': 'casino',
+    '/dice_bot': 'casino',
+    '/rob': 'casino',
+    '/buy': 'trade',
+    '/sell': 'trade',
+    '/create_coin': 'trade',
+}
+CALLBACK_CLASSES = {
+    'accept_duel': 'casino',
+    'create_tier': 'trade',
+}
+
+
+class TokenBucket:
+    """Per-key token buckets holding up to ``burst`` tokens and refilling at
+    ``rate`` per second. Buckets are kept least recently used first; one idle
+    long enough to refill completely is no different from a new one, so it is
+    dropped, and memory follows the number of recently active keys (never more
+    than ``max_keys``)."""
+
+    def __init__(self, rate, burst, max_keys=RATE_LIMIT_MAX_KEYS):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._refill_time = burst / rate
+        self._buckets = OrderedDict()  # key -> (tokens, updated_at)
+
+    def allow(self, key, cost=1):
+        """Take ``cost`` tokens from ``key``'s bucket; False if it holds fewer."""
+        now = time.monotonic()
+        self._evict(now)
+        tokens, updated_at = self._buckets.pop(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+        allowed = tokens >= cost
+        if allowed:
+            tokens -= cost
+        self._buckets[key] = (tokens, now)
+        return allowed
+
+    def retry_after(self, key, cost=1):
+        """Seconds until ``key`` could afford ``cost``."""
+        tokens, _ = self._buckets.get(key, (self.burst, 0))
+        return max(0.0, (cost - tokens) / self.rate)
+
+    def _evict(self, now):
+        buckets = self._buckets
+        while buckets:
+            key, (_, updated_at) = next(iter(buckets.items()))
+            if now - updated_at < self._refill_time and len(buckets) < self.max_keys:
+                break
+            del buckets[key]
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+limiters = {name: TokenBucket(rate, burst) for name, (rate, burst) in RATE_LIMITS.items()}
+
+
+def command_class(text):
+    command = text.split(maxsplit=1)[0].split('@')[0] if text else ''
+    return COMMAND_CLASSES.get(command, 'command')
+
+
+def callback_class(data):
+    return CALLBACK_CLASSES.get((data or '').split(':')[0], 'command')
+
+
+async def limit_api_actions(request: Request):
+    """FastAPI dependency for the action endpoints: one 'api' token per action,
+    keyed by the body's user_id, answering 429 before anything else runs. A
+    batch larger than the burst takes the whole bucket, and one larger than
+    MAX_BATCH_ACTIONS is left for the endpoint to reject with a 400."""
+    try:
+        data = await request.json()
+    except ValueError:
+        return  # let the endpoint reject the body
+    if not isinstance(data, dict):
+        return
+    actions = data.get('actions')
+    if isinstance(actions, list) and len(actions) > MAX_BATCH_ACTIONS:
+        return
+    cost = len(actions) if isinstance(actions, list) and actions else 1
+    key = data.get('user_id')
+    if not isinstance(key, (int, str)):
+        key = request.client.host if request.client else None
+    limiter = limiters['api']
+    cost = min(cost, limiter.burst)
+    if not limiter.allow(key, cost):
+        retry_after = math.ceil(limiter.retry_after(key, cost))
+        raise HTTPException(status_code=429, detail="Too many requests", headers={"Retry-After": str(retry_after)})
@@ -0,0 +1,139 @@
+import asyncio
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime
+from config import PROFILE_BUDGET_MS, PROFILE_INTERVAL_MS, PROFILE_DIR, PROFILE_MAX_FILES
+
+# Opt-in profiler for slow updates (SAMPLING_PROFILER in config.py). While any
+# update is in flight, a daemon thread samples the event loop thread's stack
+# every PROFILE_INTERVAL_MS, tagged with the asyncio task that was running.
+# Samples only go to disk when an update ends past PROFILE_BUDGET_MS: the ones
+# taken during it are written as collapsed stacks (flamegraph.pl, speedscope),
+# split into the update's own task, other tasks and the idle loop (awaiting
+# I/O or a lock). Otherwise they just age out of a bounded buffer, and with no
+# update in flight the thread sleeps.
+MAX_WINDOW = 60  # seconds of samples kept
+
+_samples = deque()  # (monotonic time, task, tuple of code objects, leaf first)
+_samples_lock = threading.Lock()
+_in_flight = 0
+_active = threading.Event()
+_stopped = threading.Event()
+_thread = None
+_loop = None
+_loop_thread_id = None
+_labels = {}
+
+_UNSAFE = re.compile(r'[^A-Za-z0-9_-]+')
+
+
+def start():
+    """Start the sampler for the running event loop's thread."""
+    global _thread, _loop, _loop_thread_id
+    if _thread is not None:
+        return
+    _loop = asyncio.get_running_loop()
+    _loop_thread_id = threading.get_ident()
+    _stopped.clear()
+    _thread = threading.Thread(target=_run, name='sampling-profiler', daemon=True)
+    _thread.start()
+
+
+def stop():
+    global _thread
+    if _thread is None:
+        return
+    _stopped.set()
+    _active.set()
+    _thread.join()
+    _thread = None
+    _samples.clear()
+
+
+def _run():
+    interval = PROFILE_INTERVAL_MS / 1000
+    current_tasks = getattr(asyncio.tasks, '_current_tasks', {})
+    while not _stopped.is_set():
+        _active.wait()
+        time.sleep(interval)
+        frame = sys._current_frames().get(_loop_thread_id)
+        task = current_tasks.get(_loop)
+        stack = []
+        while frame is not None:
+            stack.append(frame.f_code)
+            frame = frame.f_back
+        now = time.monotonic()
+        with _samples_lock:
+            _samples.append((now, task, tuple(stack)))
+            while _samples[0][0] < now - MAX_WINDOW:
+                _samples.popleft()
+
+
+def begin():
+    """Mark an update as started; returns the token for finish()."""
+    global _in_flight
+    if _thread is None:
+        start()
+    _in_flight += 1
+    _active.set()
+    return time.monotonic(), asyncio.current_task()
+
+
+def finish(token, label):
+    """Mark the update as done and, if it ran past the budget, write what the
+    loop was doing meanwhile to PROFILE_DIR."""
+    global _in_flight
+    started, task = token
+    _in_flight -= 1
+    if not _in_flight:
+        _active.clear()
+    ended = time.monotonic()
+    elapsed_ms = (ended - started) * 1000
+    if elapsed_ms < PROFILE_BUDGET_MS:
+        return
+    with _samples_lock:
+        samples = [sample for sample in _samples if started <= sample[0] <= ended]
+    if samples:
+        asyncio.get_running_loop().run_in_executor(None, _write, samples, task, label, elapsed_ms)
+
+
+def _label(code):
+    label = _labels.get(code)
+    if label is None:
+        label = _labels[code] = f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+    return label
+
+
+def _write(samples, task, label, elapsed_ms):
+    stacks = Counter()
+    for _, sample_task, stack in samples:
+        if sample_task is None:
+            root = 'event loop (idle)'
+        elif sample_task is task:
+            root = label
+        else:
+            root = 'other tasks'
+        # Collapsed format: root first, frames joined by ';', then the count
+        stacks[';'.join([root, *(_label(code).replace(';', ':') for code in reversed(stack))])] += 1
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    name = f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}_{_UNSAFE.sub('_', label)[:40]}_{elapsed_ms:.0f}ms.collapsed"
+    path = os.path.join(PROFILE_DIR, name)
+    with open(path, 'w', encoding='utf-8') as f:
+        for stack, count in stacks.most_common():
+            f.write(f'{stack} {count}\n')
+    _rotate()
+    logging.warning("Slow update %s took %.0f ms; %d samples written to %s", label, elapsed_ms, len(samples), path)
+
+
+def _rotate():
+    profiles = sorted(name for name in os.listdir(PROFILE_DIR) if name.endswith('.collapsed'))
+    for name in profiles[:-PROFILE_MAX_FILES]:
+        try:
+            os.remove(os.path.join(PROFILE_DIR, name))
+        except OSError:
+            pass
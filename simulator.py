@@ -0,0 +1,265 @@
+import argparse
+import time
+import numpy as np
+from handlers.casino_games import DICE_SIDES, ROB_SUCCESS_CHANCE, ROB_MAX_SHARE, ROB_PENALTY_RANGE, ROB_PENALTY_MULTIPLIER
+from handlers.market_logic import TIERS
+from money import AMOUNT_SCALE
+from pricing import CURVE_SCALE
+
+# Monte Carlo replay of the casino games and the coin market, for sizing the
+# bot treasury and the TIERS fees before a deploy. Games are drawn with the
+# rules imported from handlers/casino_games.py, many independent paths at a
+# time as NumPy arrays; long paths are walked in chunks of about CHUNK_CELLS
+# outcomes so memory stays flat however many games are asked for.
+#
+# Everything here is in float64 coins and tokens rather than the integer units
+# of money.py: the sub-unit rounding the engine applies is far below the noise
+# of a simulation.
+CHUNK_CELLS = 1 << 22
+PERCENTILES = (50, 90, 99, 99.9)
+CURVE_TOKENS = CURVE_SCALE / AMOUNT_SCALE  # supply at which a price has doubled
+
+
+def _percentiles(values):
+    return {p: float(v) for p, v in zip(PERCENTILES, np.percentile(values, PERCENTILES))}
+
+
+def _bets(rng, shape, bet, bet_sigma):
+    """Stakes in coins: ``bet`` each, or lognormal with median ``bet``."""
+    if not bet_sigma:
+        return np.full(shape, float(bet))
+    return bet * rng.lognormal(0.0, bet_sigma, shape)
+
+
+def _rolls(rng, shape):
+    """+1 where the first of two dice is higher, -1 where it is lower, 0 on a draw."""
+    first = rng.integers(1, DICE_SIDES + 1, shape, dtype=np.int8)
+    second = rng.integers(1, DICE_SIDES + 1, shape, dtype=np.int8)
+    return np.sign(first - second)
+
+
+def _walk(paths, steps, start, step_deltas):
+    """Follow ``paths`` balances from ``start`` over ``steps`` steps, chunk by
+    chunk. ``step_deltas(shape)`` returns (delta, stake) arrays for a chunk;
+    a step is blocked where the balance before it is below its stake.
+
+    Returns per-path final balance, minimum balance, maximum drawdown from a
+    running peak and whether any step was blocked.
+    """
+    level = np.full(paths, float(start))
+    peak = level.copy()
+    low = level.copy()
+    drawdown = np.zeros(paths)
+    blocked = np.zeros(paths, dtype=bool)
+    chunk = max(1, CHUNK_CELLS // paths)
+    for offset in range(0, steps, chunk):
+        delta, stake = step_deltas((paths, min(chunk, steps - offset)))
+        after = level[:, None] + np.cumsum(delta, axis=1)
+        before = after - delta
+        blocked |= (before < stake).any(axis=1)
+        running_peak = np.maximum(np.maximum.accumulate(after, axis=1), peak[:, None])
+        drawdown = np.maximum(drawdown, (running_peak - after).max(axis=1))
+        low = np.minimum(low, after.min(axis=1))
+        peak = running_peak[:, -1]
+        level = after[:, -1]
+    return level, low, drawdown, blocked
+
+
+def simulate_dice_bot(games=10_000, paths=1_000, treasury=100_000, bet=100, bet_sigma=0.0, seed=None):
+    """/dice_bot against the treasury: the user's die beating the bot's costs
+    the treasury the stake, losing adds it, a draw moves nothing.
+
+    Every game is played, so the treasury paths are the reserve the house
+    would need; ``refusal_probability`` is the share of paths on which
+    ``treasury`` would at some point not have covered a stake (the bot would
+    have answered "Я банкрут").
+    """
+    rng = np.random.default_rng(seed)
+    totals = {'wagered': 0.0, 'house': 0.0, 'draws': 0}
+
+    def step_deltas(shape):
+        stake = _bets(rng, shape, bet, bet_sigma)
+        delta = -_rolls(rng, shape) * stake  # the user's die first
+        totals['wagered'] += stake.sum()
+        totals['house'] += delta.sum()
+        totals['draws'] += int(np.count_nonzero(delta == 0))
+        return delta, stake
+
+    final, low, drawdown, refused = _walk(paths, games, treasury, step_deltas)
+    return {
+        'games': games * paths,
+        'house_edge': totals['house'] / totals['wagered'],
+        'draw_rate': totals['draws'] / (games * paths),
+        'treasury_final': _percentiles(final),
+        'treasury_min': _percentiles(low),
+        'max_drawdown': _percentiles(drawdown),
+        'refusal_probability': float(refused.mean()),
+    }
+
+
+def simulate_duels(duels=1_000, pairs=10_000, balance=1_000, bet=100, bet_sigma=0.0, seed=None):
+    """/dice between two players, ``duels`` rounds per pair. Duels are zero
+    sum and a draw refunds both, so nothing reaches the treasury; what
+    matters is how fast one side goes broke (``ruin_probability``: the
+    challenger could not cover a stake at some point)."""
+    rng = np.random.default_rng(seed)
+    totals = {'wagered': 0.0, 'draws': 0}
+
+    def step_deltas(shape):
+        stake = _bets(rng, shape, bet, bet_sigma)
+        delta = _rolls(rng, shape) * stake  # the challenger's die first
+        totals['wagered'] += stake.sum()
+        totals['draws'] += int(np.count_nonzero(delta == 0))
+        return delta, stake
+
+    final, low, drawdown, ruined = _walk(pairs, duels, balance, step_deltas)
+    return {
+        'duels': duels * pairs,
+        'wagered': totals['wagered'],
+        'draw_rate': totals['draws'] / (duels * pairs),
+        'challenger_final': _percentiles(final),
+        'challenger_max_drawdown': _percentiles(drawdown),
+        'ruin_probability': float(ruined.mean()),
+        'treasury_flow': 0.0,
+    }
+
+
+def simulate_rob(attempts=100, pairs=100_000, robber_balance=1_000, target_balance=10_000, seed=None):
+    """/rob repeated by one robber on one target, ``attempts`` times per
+    pair, with the balances carried over as in the handler: a success takes
+    uniform(1, ROB_MAX_SHARE * target balance) from the target, a failure
+    burns a penalty if the robber can pay it. Penalties leave the economy
+    (they are not credited to the treasury), reported as ``burned``."""
+    rng = np.random.default_rng(seed)
+    robber = np.full(pairs, float(robber_balance))
+    target = np.full(pairs, float(target_balance))
+    stolen = burned = 0.0
+    successes = 0
+    low, high = ROB_PENALTY_RANGE
+    for _ in range(attempts):
+        success = rng.random(pairs) < ROB_SUCCESS_CHANCE
+        # random.uniform(a, b) is a + (b - a) * U, also when b < a (a poor target)
+        steal = 1.0 + (target * ROB_MAX_SHARE - 1.0) * rng.random(pairs)
+        penalty = (low + (high - low) * rng.random(pairs)) * ROB_PENALTY_MULTIPLIER
+        steal = np.where(success, steal, 0.0)
+        penalty = np.where(~success & (robber >= penalty), penalty, 0.0)
+        robber += steal - penalty
+        target -= steal
+        stolen += steal.sum()
+        burned += penalty.sum()
+        successes += int(success.sum())
+    total = attempts * pairs
+    return {
+        'attempts': total,
+        'success_rate': successes / total,
+        'stolen_per_attempt': stolen / total,
+        'burned_per_attempt': burned / total,
+        'robber_gain': _percentiles(robber - robber_balance),
+        'robber_profit_probability': float((robber > robber_balance).mean()),
+        'target_loss': _percentiles(target_balance - target),
+        'target_negative_probability': float((target < 0).mean()),
+    }
+
+
+def _curve_total(initial_price, supply, side, amount):
+    # pricing.buy_cost / sell_proceeds in whole tokens and coins
+    direction = np.where(side, 1.0, -1.0)
+    return initial_price * amount * (2 * CURVE_TOKENS + 2 * supply + direction * amount) / (2 * CURVE_TOKENS)
+
+
+def simulate_trades(trades=1_000, coins=10_000, initial_price=1.0, buy_share=0.55, trade_size=10.0,
+                    size_sigma=1.0, seed=None):
+    """Random order flow on ``coins`` fresh coins per tier, ``trades``
+    orders each: buys with probability ``buy_share``, lognormal sizes with
+    median ``trade_size`` tokens; sells larger than the supply are rejected
+    as the engine does. Traders are assumed to afford their orders.
+
+    Per tier, reports volume, creator royalties, bot fees paid into the
+    treasury and the creator's royalty return on the tier cost. Both fees
+    are credited on top of the curve total, so they are new money.
+    """
+    rng = np.random.default_rng(seed)
+    report = {}
+    for tier, info in TIERS.items():
+        supply = np.zeros(coins)
+        volume = np.zeros(coins)
+        rejected = 0
+        for _ in range(trades):
+            side = rng.random(coins) < buy_share
+            amount = trade_size * rng.lognormal(0.0, size_sigma, coins)
+            valid = side | (amount <= supply)
+            amount = np.where(valid, amount, 0.0)
+            volume += _curve_total(initial_price, supply, side, amount)
+            supply += np.where(side, amount, -amount)
+            rejected += coins - int(valid.sum())
+        royalties = volume * info['fee']
+        report[tier] = {
+            'trades': trades * coins - rejected,
+            'rejected': rejected,
+            'volume': float(volume.sum()),
+            'royalties': float(royalties.sum()),
+            'treasury_fees': float((volume * info['bot_fee']).sum()),
+            'final_price': _percentiles(initial_price * (1 + supply / CURVE_TOKENS)),
+            'creator_roi': _percentiles(royalties / info['cost']),
+            'creator_break_even_probability': float((royalties >= info['cost']).mean()),
+        }
+    return report
+
+
+SCENARIOS = {
+    'dice_bot': simulate_dice_bot,
+    'duel': simulate_duels,
+    'rob': simulate_rob,
+    'trades': simulate_trades,
+}
+
+
+def _print_report(name, report, elapsed, indent=''):
+    if name:
+        print(f'{indent}{name} ({elapsed:.2f}s)' if elapsed is not None else f'{indent}{name}')
+    for key, value in report.items():
+        if isinstance(value, dict) and all(isinstance(k, str) for k in value):
+            _print_report(key, value, None, indent + '  ')
+        elif isinstance(value, dict):
+            print(f'{indent}  {key}: ' + ', '.join(f'p{p:g}={v:,.2f}' for p, v in value.items()))
+        elif isinstance(value, float):
+            print(f'{indent}  {key}: {value:,.6g}')
+        else:
+            print(f'{indent}  {key}: {value:,}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Monte Carlo simulation of the casino and market economics')
+    parser.add_argument('scenario', nargs='?', default='all', choices=['all', *SCENARIOS])
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--paths', type=int, default=1_000, help='dice_bot treasury paths / duel pairs')
+    parser.add_argument('--games', type=int, default=10_000, help='games per path')
+    parser.add_argument('--treasury', type=float, default=100_000, help='starting bot treasury (coins)')
+    parser.add_argument('--bet', type=float, default=100, help='median stake (coins)')
+    parser.add_argument('--bet-sigma', type=float, default=0.0, help='lognormal spread of stakes, 0 = fixed')
+    parser.add_argument('--balance', type=float, default=1_000, help='duel players\' / robbers\' starting balance')
+    parser.add_argument('--target-balance', type=float, default=10_000, help='rob targets\' starting balance')
+    parser.add_argument('--rob-pairs', type=int, default=100_000)
+    parser.add_argument('--rob-attempts', type=int, default=100)
+    parser.add_argument('--coins', type=int, default=10_000, help='coins per tier')
+    parser.add_argument('--trades', type=int, default=1_000, help='orders per coin')
+    parser.add_argument('--initial-price', type=float, default=1.0)
+    parser.add_argument('--buy-share', type=float, default=0.55)
+    parser.add_argument('--trade-size', type=float, default=10.0, help='median order (tokens)')
+    args = parser.parse_args()
+
+    runs = {
+        'dice_bot': lambda: simulate_dice_bot(args.games, args.paths, args.treasury, args.bet, args.bet_sigma, args.seed),
+        'duel': lambda: simulate_duels(args.games, args.paths, args.balance, args.bet, args.bet_sigma, args.seed),
+        'rob': lambda: simulate_rob(args.rob_attempts, args.rob_pairs, args.balance, args.target_balance, args.seed),
+        'trades': lambda: simulate_trades(args.trades, args.coins, args.initial_price, args.buy_share, args.trade_size,
+                                          seed=args.seed),
+    }
+    for name in (SCENARIOS if args.scenario == 'all' else [args.scenario]):
+        started = time.perf_counter()
+        report = runs[name]()
+        _print_report(name, report, time.perf_counter() - started)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,34 @@
+import pytest
+from money import MAX_UNITS, MONEY_SCALE, to_money, to_amount, to_rate, format_money
+
+
+def test_parses_to_minor_units():
+    assert to_money('1.5') == 1_500_000
+    assert to_amount(2) == 2_000_000
+    assert to_rate(0.005) == 5_000
+
+
+def test_rounds_half_even():
+    assert to_money('0.0000005') == 0
+    assert to_money('0.0000015') == 2
+
+
+@pytest.mark.parametrize('value', ['abc', '', 'nan', 'inf', '-inf', None])
+def test_rejects_non_numbers(value):
+    with pytest.raises(ValueError):
+        to_money(value)
+
+
+def test_largest_values_that_fit_in_sqlite():
+    largest = format_money(MAX_UNITS, 6)
+    assert to_money(largest) == MAX_UNITS
+    assert to_money('-' + largest) == -MAX_UNITS
+
+
+@pytest.mark.parametrize('value', ['1e20', '-1e20', '9223372036854.775808', 10**30, 1e300])
+def test_rejects_values_out_of_range(value):
+    with pytest.raises(ValueError):
+        to_money(value)
+    with pytest.raises(ValueError):
+        to_amount(value)
+
@@ -0,0 +1,80 @@
+import asyncio
+import contextvars
+import database
+import order_queue
+import query_profiler
+import transaction_log
+import treasury
+from money import to_money, to_amount, to_rate
+
+
+def run_trades(tmp_path, monkeypatch, scenario):
+    # A fresh database with profiling on, two funded users and one coin
+    monkeypatch.setattr(database, 'DATABASE_PATH', str(tmp_path / 'test.db'))
+    monkeypatch.setattr(database, 'QUERY_PROFILING', True)
+    monkeypatch.setattr(order_queue, '_queues', {})
+    monkeypatch.setattr(order_queue, '_workers', {})
+    monkeypatch.setattr(treasury, '_flush_handle', None)
+    # asyncio primitives bind to the first loop that waits on them
+    monkeypatch.setattr(transaction_log, '_batch_full', asyncio.Event())
+
+    async def main():
+        await database.init_db()
+        try:
+            for user_id in (1, 2):
+                await database.create_user(user_id, f'user{user_id}')
+            await database.create_coin('AAA', 1, to_money(1), 'Bronze', to_rate(0.005), to_rate(0.01))
+            return await scenario()
+        finally:
+            await order_queue.drain()
+            await transaction_log.stop()
+            await database.close_db()
+
+    return asyncio.run(main())
+
+
+async def buy(label, user_id):
+    with query_profiler.profile_scope(label) as query_scope:
+        await order_queue.submit_order(user_id, 'AAA', 'buy', to_amount(1))
+    return query_scope
+
+
+def test_updates_sharing_a_worker_are_each_charged_for_their_trade(tmp_path, monkeypatch):
+    async def scenario():
+        # The first update starts the worker; the second reuses it
+        first = await buy('first', 1)
+        second = await buy('second', 2)
+        return first, second
+
+    first, second = run_trades(tmp_path, monkeypatch, scenario)
+    assert first.queries > 0
+    assert second.queries == first.queries
+    assert second.rows == first.rows
+
+
+def test_coalesced_batch_is_split_evenly(tmp_path, monkeypatch):
+    async def scenario():
+        alone = await buy('alone', 1)
+        # Both orders are queued before the worker runs, so they share one batch
+        together = await asyncio.gather(buy('first', 1), buy('second', 2))
+        return alone, together
+
+    alone, (first, second) = run_trades(tmp_path, monkeypatch, scenario)
+    assert first.queries == second.queries
+    assert first.queries + second.queries == alone.queries
+
+
+def test_background_work_is_not_charged_to_the_update_that_started_it(tmp_path, monkeypatch):
+    async def scenario():
+        with query_profiler.profile_scope('starter') as query_scope:
+            await order_queue.submit_order(1, 'AAA', 'buy', to_amount(1))
+            charged = query_scope.queries
+            # Another user's order, on the worker this update started
+            await asyncio.create_task(order_queue.submit_order(2, 'AAA', 'buy', to_amount(1)),
+                                      context=contextvars.Context())
+            # And the audit rows, written by the transaction log's worker
+            await transaction_log.stop()
+            return charged, query_scope.queries
+
+    charged, total = run_trades(tmp_path, monkeypatch, scenario)
+    assert total == charged
@@ -0,0 +1,62 @@
+import asyncio
+import transaction_log
+
+
+def setup_log(tmp_path, monkeypatch, add_transactions):
+    monkeypatch.setattr(transaction_log, 'add_transactions', add_transactions)
+    monkeypatch.setattr(transaction_log, 'RETRY_DELAY', 0.01)
+    monkeypatch.setattr(transaction_log, 'FLUSH_INTERVAL', 0.01)
+    monkeypatch.setattr(transaction_log, 'FALLBACK_PATH', str(tmp_path / 'pending.jsonl'))
+    monkeypatch.setattr(transaction_log, '_batch_full', asyncio.Event())
+
+
+def test_failed_batch_is_retried_until_written(tmp_path, monkeypatch):
+    written = []
+    failures = [transaction_log.MAX_ATTEMPTS + 2]
+
+    async def add_transactions(rows):
+        if failures[0]:
+            failures[0] -= 1
+            raise OSError('disk I/O error')
+        written.extend(rows)
+
+    setup_log(tmp_path, monkeypatch, add_transactions)
+
+    async def scenario():
+        transaction_log.start()
+        for user_id in range(3):
+            await transaction_log.add_transaction(user_id, 'AAA', 'buy', 1, 1, 0)
+        # Well past MAX_ATTEMPTS, with no shutdown to fall back on
+        while len(written) < 3:
+            await asyncio.sleep(0.01)
+        await transaction_log.stop()
+
+    asyncio.run(asyncio.wait_for(scenario(), 10))
+    assert [row[0] for row in written] == [0, 1, 2]
+    assert not (tmp_path / 'pending.jsonl').exists()
+
+
+def test_rows_still_failing_at_shutdown_are_written_at_next_start(tmp_path, monkeypatch):
+    written = []
+    broken = [True]
+
+    async def add_transactions(rows):
+        if broken[0]:
+            raise OSError('database is locked')
+        written.extend(rows)
+
+    setup_log(tmp_path, monkeypatch, add_transactions)
+
+    async def scenario():
+        transaction_log.start()
+        await transaction_log.add_transaction(1, 'AAA', 'buy', 1, 1, 0)
+        await transaction_log.stop()
+        assert written == []
+        broken[0] = False
+        transaction_log.start()
+        await transaction_log.add_transaction(2, 'AAA', 'sell', 1, 1, 0)
+        await transaction_log.stop()
+
+    asyncio.run(scenario())
+    assert [row[0] for row in written] == [1, 2]
+    assert not (tmp_path / 'pending.jsonl').exists()
@@ -0,0 +1,39 @@
+import asyncio
+import treasury
+
+
+def test_set_balance_waits_for_a_flush_in_progress(monkeypatch):
+    ledger = {'balance': 100}
+    writes = []
+
+    async def add_treasury_balance(delta):
+        await asyncio.sleep(0.01)
+        ledger['balance'] += delta
+        writes.append(('add', delta))
+        return ledger['balance']
+
+    async def set_treasury_balance(amount):
+        ledger['balance'] = amount
+        writes.append(('set', amount))
+
+    monkeypatch.setattr(treasury, 'add_treasury_balance', add_treasury_balance)
+    monkeypatch.setattr(treasury, 'set_treasury_balance', set_treasury_balance)
+    monkeypatch.setattr(treasury, '_persisted', 100)
+    monkeypatch.setattr(treasury, '_pending', 0)
+    monkeypatch.setattr(treasury, '_flush_handle', None)
+    monkeypatch.setattr(treasury, '_lock', asyncio.Lock())
+
+    async def scenario():
+        treasury.add(5)
+        treasury._flush_handle.cancel()
+        flushing = asyncio.create_task(treasury.flush())
+        await asyncio.sleep(0)
+        await treasury.set_balance(1000)
+        await flushing
+        treasury.add(7)
+        treasury._flush_handle.cancel()
+        return treasury.get_balance()
+
+    assert asyncio.run(scenario()) == 1007
+    assert writes == [('add', 5), ('set', 1000)]
+    assert ledger['balance'] == 1000
@@ -0,0 +1,61 @@
+import random
+from trigger_matcher import TriggerMatcher
+
+
+def first_match(words, text):
+    # The word ending earliest in the text; the longest one if several end there
+    text = text.lower()
+    for end in range(1, len(text) + 1):
+        found = [word for word in words if text.endswith(word, 0, end)]
+        if found:
+            return max(found, key=len)
+    return None
+
+
+def test_matches_the_first_word_in_the_text():
+    matcher = TriggerMatcher()
+    for user_id, word in enumerate(['he', 'she', 'his', 'hers']):
+        matcher.add(word, user_id)
+    assert matcher.match('uSHErs') == 'she'
+    assert matcher.match('ahis') == 'his'
+    assert matcher.match('nothing') is None
+
+
+def test_new_word_relinks_existing_nodes():
+    # 'abc' is already in the trie when 'bce' arrives; matching 'abce' must
+    # fall back from 'abc' to the new 'bc' node to find it
+    matcher = TriggerMatcher()
+    matcher.add('abcd', 1)
+    matcher.add('bce', 2)
+    assert matcher.match('xabce') == 'bce'
+
+
+def test_expired_words_are_skipped_and_can_come_back():
+    matcher = TriggerMatcher()
+    matcher.add('cat', 1)
+    matcher.add('at', 2)
+    matcher.remove('cat', 1)
+    assert matcher.match('cat') == 'at'
+    matcher.remove('at', 2)
+    assert matcher.match('cat') is None
+    matcher.add('cat', 3)
+    assert matcher.match('a cat') == 'cat'
+
+
+def test_incremental_updates_match_a_brute_force_search():
+    rng = random.Random(7)
+    matcher = TriggerMatcher()
+    owners = {}
+    for step in range(3000):
+        word = ''.join(rng.choice('abc') for _ in range(rng.randint(1, 5)))
+        if rng.random() < 0.6:
+            matcher.add(word, step)
+            owners.setdefault(word, set()).add(step)
+        elif owners:
+            word = rng.choice(sorted(owners))
+            user_id = owners[word].pop()
+            if not owners[word]:
+                del owners[word]
+            matcher.remove(word, user_id)
+        text = ''.join(rng.choice('abcd') for _ in range(rng.randint(0, 12)))
+        assert matcher.match(text) == first_match(owners, text), (step, text)
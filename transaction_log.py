@@ -0,0 +1,112 @@
+import asyncio
+import contextvars
+import json
+import logging
+import os
+from datetime import datetime, timezone
+from database import add_transactions
+
+# The transactions table is an audit trail nobody reads synchronously, so rows
+# are queued and inserted in batches off the trade path. A batch that fails is
+# retried, ahead of newer rows, until it lands; meanwhile the bounded queue
+# fills up and callers wait. Only at shutdown does a batch that still fails go
+# to FALLBACK_PATH, and the next start() queues those rows first.
+BATCH_SIZE = 500
+FLUSH_INTERVAL = 0.25  # seconds a partial batch may wait
+QUEUE_SIZE = 10000
+RETRY_DELAY = 1
+MAX_RETRY_DELAY = 30
+MAX_ATTEMPTS = 3  # while stopping, before falling back to the file
+FALLBACK_PATH = 'transactions_pending.jsonl'
+
+_queue = None
+_worker = None
+_stopping = False
+_batch_full = asyncio.Event()
+
+
+def start():
+    global _queue, _worker, _stopping
+    if _worker is None:
+        recovered = _load_fallback()
+        # Room for the recovered rows on top of the usual bound
+        _queue = asyncio.Queue(QUEUE_SIZE + len(recovered))
+        for row in recovered:
+            _queue.put_nowait(row)
+        _stopping = False
+        _worker = asyncio.create_task(_run(), context=contextvars.Context())
+
+
+async def add_transaction(user_id, ticker, type_, amount, price, timestamp=None):
+    """Queue an audit row; waits only when the queue is full. ``timestamp``
+    is the unix time of the trade and defaults to now."""
+    if _worker is None:
+        start()
+    # Same text format as CURRENT_TIMESTAMP, taken when the trade happened
+    when = datetime.fromtimestamp(timestamp, timezone.utc) if timestamp is not None else datetime.now(timezone.utc)
+    timestamp = when.strftime('%Y-%m-%d %H:%M:%S')
+    await _queue.put((user_id, ticker, type_, amount, price, timestamp))
+    if _queue.qsize() >= BATCH_SIZE - 1:
+        _batch_full.set()
+
+
+async def _run():
+    while True:
+        batch = [await _queue.get()]
+        if _queue.qsize() < BATCH_SIZE - 1:
+            # Give a partial batch up to FLUSH_INTERVAL to fill
+            _batch_full.clear()
+            try:
+                await asyncio.wait_for(_batch_full.wait(), FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+        while len(batch) < BATCH_SIZE and not _queue.empty():
+            batch.append(_queue.get_nowait())
+        await _write(batch)
+        for _ in batch:
+            _queue.task_done()
+
+
+async def _write(batch):
+    delay = RETRY_DELAY
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            await add_transactions(batch)
+            return
+        except Exception:
+            logging.exception("Failed to write %d transaction rows (attempt %d)", len(batch), attempt)
+            if _stopping and attempt >= MAX_ATTEMPTS:
+                _save_fallback(batch)
+                return
+            await asyncio.sleep(RETRY_DELAY if _stopping else delay)
+            delay = min(delay * 2, MAX_RETRY_DELAY)
+
+
+def _save_fallback(batch):
+    with open(FALLBACK_PATH, 'a', encoding='utf-8') as f:
+        for row in batch:
+            f.write(json.dumps(row) + '\n')
+    logging.error("Saved %d transaction rows to %s; they are written at the next start", len(batch), FALLBACK_PATH)
+
+
+def _load_fallback():
+    if not os.path.exists(FALLBACK_PATH):
+        return []
+    with open(FALLBACK_PATH, encoding='utf-8') as f:
+        rows = [tuple(json.loads(line)) for line in f if line.strip()]
+    os.remove(FALLBACK_PATH)
+    logging.info("Queued %d transaction rows from %s", len(rows), FALLBACK_PATH)
+    return rows
+
+
+async def stop():
+    """Write out everything queued, then stop the worker."""
+    global _queue, _worker, _stopping
+    if _worker is None:
+        return
+    _stopping = True
+    await _queue.join()
+    _worker.cancel()
+    _queue, _worker = None, None
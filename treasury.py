@@ -0,0 +1,71 @@
+import asyncio
+import contextvars
+from database import get_treasury_balance, add_treasury_balance, set_treasury_balance
+
+# Casino results and trade fees are summed in memory and written to the
+# treasury ledger as one delta at most every FLUSH_INTERVAL seconds; all values
+# are integer money units (see money.py)
+FLUSH_INTERVAL = 5
+
+_persisted = 0
+_pending = 0
+_flush_handle = None
+# Orders flushes against absolute writes, so a delta never lands on top of set_balance()
+_lock = asyncio.Lock()
+
+
+async def load():
+    global _persisted
+    _persisted = await get_treasury_balance()
+
+
+def get_balance():
+    return _persisted + _pending
+
+
+def can_cover(amount):
+    """Reserve check for bot games; served from memory, no DB read."""
+    return get_balance() >= amount
+
+
+def add(delta):
+    global _pending, _flush_handle
+    _pending += delta
+    if _flush_handle is None:
+        _flush_handle = asyncio.get_running_loop().call_later(FLUSH_INTERVAL, _schedule_flush, context=contextvars.Context())
+
+
+def _schedule_flush():
+    global _flush_handle
+    _flush_handle = None
+    asyncio.create_task(flush())
+
+
+async def flush():
+    global _persisted, _pending
+    async with _lock:
+        delta = _pending
+        if not delta:
+            return
+        _pending = 0
+        try:
+            # The returned balance also picks up deltas flushed by other processes
+            _persisted = await add_treasury_balance(delta)
+        except Exception:
+            _pending += delta
+            add(0)
+            raise
+
+
+async def set_balance(amount):
+    """Overwrite the balance once any flush in progress has landed; deltas
+    pending until now are replaced, later ones apply on top of ``amount``."""
+    global _persisted, _pending
+    async with _lock:
+        pending, _pending = _pending, 0
+        try:
+            await set_treasury_balance(amount)
+        except Exception:
+            _pending += pending
+            raise
+        _persisted = amount
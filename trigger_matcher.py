@@ -0,0 +1,214 @@
+from collections import deque
+from expiry import call_at
+
+
+class TriggerMatcher:
+    """Aho-Corasick automaton over the active trigger words.
+
+    A bought word is linked in incrementally: failure links are computed for
+    the nodes added under it, existing nodes that now have one of those nodes
+    as their longest proper suffix (found through the failure tree) are
+    relinked, and output links are patched only below the
+    nodes that changed. Expired words are dropped from the owners by an expiry
+    timer, on time, and left in the trie as tombstones that matching skips;
+    once most of its words are dead the trie is rebuilt from the live ones in
+    one pass. Matching is a single pass over the lowercased text.
+    """
+
+    def __init__(self):
+        # word -> {user_id: expires_at or None}
+        self._owners = {}
+        self._reset()
+
+    def _reset(self):
+        self._goto = [{}]
+        self._fail = [0]
+        # Nearest node on the failure chain (the node itself included) that ends a word
+        self._out = [None]
+        self._depth = [0]
+        self._fail_children = [set()]
+        self._by_char = {}  # char -> nodes entered through it
+        self._terminals = {}  # node -> word, live or tombstoned
+
+    def add(self, word, user_id, expires_at=None):
+        """``expires_at`` is in unix seconds; None never expires."""
+        word = self._own(word, user_id, expires_at)
+        if word:
+            self._link(word)
+
+    def remove(self, word, user_id):
+        word = word.lower()
+        owners = self._owners.get(word)
+        if not owners or user_id not in owners:
+            return
+        del owners[user_id]
+        if not owners:
+            # The word's nodes stay behind as a tombstone
+            del self._owners[word]
+            if len(self._owners) * 2 < len(self._terminals):
+                self._rebuild()
+
+    def load(self, triggers):
+        """Replace the automaton with rows of (user_id, word, expires_at)."""
+        self._owners = {}
+        for user_id, word, expires_at in triggers:
+            self._own(word, user_id, expires_at)
+        self._rebuild()
+
+    def match(self, text):
+        """Return the first active trigger word found in ``text``, or None."""
+        owners = self._owners
+        if not owners:
+            return None
+        goto, fail, out, terminals = self._goto, self._fail, self._out, self._terminals
+        state = 0
+        for char in text.lower():
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            node = out[state]
+            while node is not None:
+                word = terminals[node]
+                if word in owners:
+                    return word
+                node = out[fail[node]]
+        return None
+
+    def _own(self, word, user_id, expires_at):
+        word = word.lower()
+        if not word:
+            return None
+        self._owners.setdefault(word, {})[user_id] = expires_at
+        if expires_at is not None:
+            call_at(expires_at, self._expire, word, user_id, expires_at)
+        return word
+
+    def _insert(self, word):
+        # Adds the word's nodes without linking them; returns the path from the
+        # root, the nodes created and whether the word's end node is new to it
+        goto, depth = self._goto, self._depth
+        path = [0]
+        created = []
+        state = 0
+        for char in word:
+            nxt = goto[state].get(char)
+            if nxt is None:
+                nxt = len(goto)
+                goto[state][char] = nxt
+                goto.append({})
+                self._fail.append(0)
+                self._out.append(None)
+                depth.append(depth[state] + 1)
+                self._fail_children.append(set())
+                self._by_char.setdefault(char, []).append(nxt)
+                created.append(nxt)
+            state = nxt
+            path.append(state)
+        terminal = state not in self._terminals
+        if terminal:
+            self._terminals[state] = word
+        return path, created, terminal
+
+    def _link(self, word):
+        path, created, terminal = self._insert(word)
+        if not created and not terminal:
+            return
+        goto, fail, depth = self._goto, self._fail, self._depth
+        changed = []
+        for node in created:
+            i = depth[node]
+            char = word[i - 1]
+            link = fail[path[i - 1]] if i > 1 else 0
+            while link and char not in goto[link]:
+                link = fail[link]
+            target = goto[link].get(char, 0)
+            self._set_fail(node, target if target != node else 0)
+            changed.append(node)
+        if created:
+            # Existing nodes that end in word[:i] for some new node word[:i] get
+            # the deepest such node as their failure link. Those ending in
+            # word[:first] are the ones entered through word[0] when first is
+            # 1, and otherwise the children, through word[first - 1], of the
+            # failure subtree of word[:first - 1]; each further character of
+            # the word narrows them down
+            fresh = set(created)
+            first = depth[created[0]]
+            char = word[first - 1]
+            if first == 1:
+                candidates = self._by_char.get(char, [])
+            else:
+                candidates = [goto[node][char] for node in self._fail_subtree(path[first - 1]) if char in goto[node]]
+            for i in range(first, len(word) + 1):
+                if i > first:
+                    char = word[i - 1]
+                    candidates = [goto[node][char] for node in candidates if char in goto[node]]
+                    if not candidates:
+                        break
+                suffix = path[i]
+                for node in candidates:
+                    if node not in fresh and depth[node] > i and depth[fail[node]] < i:
+                        self._set_fail(node, suffix)
+                        changed.append(node)
+        if terminal:
+            changed.append(path[-1])
+        # Shallower nodes first, so every failure target's output is final when read
+        changed.sort(key=depth.__getitem__)
+        for node in changed:
+            self._update_out(node)
+
+    def _fail_subtree(self, root):
+        # Every node whose string ends in root's
+        fail_children = self._fail_children
+        nodes = [root]
+        for node in nodes:
+            nodes.extend(fail_children[node])
+        return nodes
+
+    def _set_fail(self, node, target):
+        self._fail_children[self._fail[node]].discard(node)
+        self._fail[node] = target
+        self._fail_children[target].add(node)
+
+    def _update_out(self, root):
+        # Recompute outputs down the failure tree, stopping where nothing changes
+        fail, out, terminals, fail_children = self._fail, self._out, self._terminals, self._fail_children
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            value = node if node in terminals else out[fail[node]]
+            if value == out[node] and node != root:
+                continue
+            out[node] = value
+            stack.extend(fail_children[node])
+
+    def _rebuild(self):
+        self._reset()
+        for word in self._owners:
+            self._insert(word)
+        goto, fail, out, terminals, fail_children = self._goto, self._fail, self._out, self._terminals, self._fail_children
+        queue = deque()
+        for child in goto[0].values():
+            fail_children[0].add(child)
+            out[child] = child if child in terminals else None
+            queue.append(child)
+        while queue:
+            state = queue.popleft()
+            for char, child in goto[state].items():
+                link = fail[state]
+                while link and char not in goto[link]:
+                    link = fail[link]
+                target = goto[link].get(char, 0)
+                fail[child] = target
+                fail_children[target].add(child)
+                # Report this node's own word, or the nearest one along the failure chain
+                out[child] = child if child in terminals else out[target]
+                queue.append(child)
+
+    def _expire(self, word, user_id, expires_at):
+        owners = self._owners.get(word)
+        # Skip entries superseded by a later purchase of the same word (or a reload)
+        if owners and user_id in owners and owners[user_id] == expires_at:
+            self.remove(word, user_id)
+
+
+matcher = TriggerMatcher()
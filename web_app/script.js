@@ -23,10 +23,19 @@ function sendToBot(action, data = {}) {
     tg.sendData(JSON.stringify(payload));
 }
 
-// Load user balance and tokens
+// Latest prices pushed for the tokens the user holds
+let latestPrices = {};
+let updatesSocket = null;
+let reconnectDelay = 1000;
+
+// Load user balance and tokens (skipped while the server is pushing updates)
 async function loadUserData() {
+    if (updatesSocket && updatesSocket.readyState === WebSocket.OPEN) {
+        return;
+    }
     try {
-        const response = await fetch(`${API_BASE}/api/user/${userId}`);
+        // Revalidate with the server's ETag; unchanged data comes back as a 304
+        const response = await fetch(`${API_BASE}/api/user/${userId}`, { cache: 'no-cache' });
         const data = await response.json();
         document.getElementById('balance').textContent = `Баланс: ${data.balance} 💰`;
         displayTokens(data.tokens);
@@ -36,6 +45,34 @@ async function loadUserData() {
     }
 }
 
+// Subscribe to balance, token and price updates; reconnects with backoff
+function connectUpdates() {
+    updatesSocket = new WebSocket(`${API_BASE.replace(/^http/, 'ws')}/ws/${userId}`);
+    let lastTokens = [];
+    updatesSocket.onopen = () => {
+        reconnectDelay = 1000;
+    };
+    updatesSocket.onmessage = (event) => {
+        const update = JSON.parse(event.data);
+        if (update.balance !== undefined) {
+            document.getElementById('balance').textContent = `Баланс: ${update.balance} 💰`;
+        }
+        if (update.prices) {
+            Object.assign(latestPrices, update.prices);
+        }
+        if (update.tokens) {
+            lastTokens = update.tokens;
+        }
+        if (update.tokens || update.prices) {
+            displayTokens(lastTokens);
+        }
+    };
+    updatesSocket.onclose = () => {
+        setTimeout(connectUpdates, reconnectDelay);
+        reconnectDelay = Math.min(reconnectDelay * 2, 30000);
+    };
+}
+
 // Display tokens
 function displayTokens(tokens) {
     const container = document.getElementById('myTokens');
@@ -43,7 +80,11 @@ function displayTokens(tokens) {
         container.textContent = 'Немає токенів';
         return;
     }
-    container.innerHTML = tokens.map(token => `<div class="token-item">${token.name}: ${token.amount} шт.</div>`).join('');
+    container.innerHTML = tokens.map(token => {
+        const price = latestPrices[token.name];
+        const priceText = price !== undefined ? ` @ ${price.toFixed(4)} 💰` : '';
+        return `<div class="token-item">${token.name}: ${token.amount} шт.${priceText}</div>`;
+    }).join('');
 }
 
 // Show help
@@ -59,11 +100,15 @@ function showHelp() {
 
 // Show top players
 async function showTop() {
-    // For now, simulate; integrate with API later
-    const topText = `Топ гравців:
-1. Player1 - 5000 💰
-2. Player2 - 4000 💰`;
-    showOutput(topText);
+    try {
+        const response = await fetch(`${API_BASE}/api/top?limit=10`);
+        const top = await response.json();
+        const lines = top.map((user, i) => `${i + 1}. ${user.username} - ${user.equity.toFixed(2)} 💰`);
+        showOutput(`Топ гравців:\n${lines.join('\n')}`);
+    } catch (error) {
+        console.error('Error loading top:', error);
+        showOutput('Помилка завантаження');
+    }
 }
 
 // Give money
@@ -98,6 +143,53 @@ function buyToken() {
     }
 }
 
+// Quote token price for the entered amount
+async function quoteToken() {
+    const name = document.getElementById('tokenName').value;
+    const amount = document.getElementById('tokenAmount').value;
+    if (!name || !amount) {
+        return;
+    }
+    try {
+        const response = await fetch(`${API_BASE}/api/quote`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ orders: [{ name: name, side: 'buy', amount: parseFloat(amount) }] })
+        });
+        const quote = (await response.json()).quotes[0];
+        if (quote.error) {
+            showOutput('Токен не знайдено');
+            return;
+        }
+        showOutput(`${amount} ${name}: ${parseFloat(quote.total).toFixed(4)} 💰 (ціна після покупки ${parseFloat(quote.new_price).toFixed(4)})`);
+    } catch (error) {
+        console.error('Error loading quote:', error);
+    }
+}
+
+// Show recent hourly candles for a token
+async function showCandles() {
+    const name = document.getElementById('tokenName').value;
+    if (!name) {
+        return;
+    }
+    try {
+        const response = await fetch(`${API_BASE}/api/candles/${encodeURIComponent(name)}?interval=1h&limit=12`);
+        const candles = await response.json();
+        if (candles.length === 0) {
+            showOutput('Немає угод');
+            return;
+        }
+        const lines = candles.map(c => {
+            const hour = new Date(c.t * 1000).toLocaleTimeString([], { hour: '2-digit', minute: '2-digit' });
+            return `${hour}  O ${c.o.toFixed(4)}  H ${c.h.toFixed(4)}  L ${c.l.toFixed(4)}  C ${c.c.toFixed(4)}  V ${c.v}`;
+        });
+        showOutput(`${name.toUpperCase()} (1h):\n${lines.join('\n')}`);
+    } catch (error) {
+        console.error('Error loading candles:', error);
+    }
+}
+
 // Sell token
 function sellToken() {
     const name = document.getElementById('sellTokenName').value;
@@ -164,5 +256,6 @@ function showOutput(text) {
     document.getElementById('output').textContent = text;
 }
 
-// Load initial data
-loadUserData();
\ No newline at end of file
+// Load initial data, then switch to pushed updates
+loadUserData();
+connectUpdates();
\ No newline at end of file